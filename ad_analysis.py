@@ -1,128 +1,679 @@
-import json
+import os
+import asyncio
+from contextlib import aclosing, AsyncExitStack
 from together_ai import (
-    analyze_product_name,
-    validate_with_together_ai,
-    idea_from_ad_text_using_together,
-    idea_from_ad_image_using_together,
+    analyze_product_name_async,
+    validate_with_together_ai_async,
+    validate_batch_with_together_ai_async,
+    chunk_ads_by_token_budget,
+    TOGETHER_TEXT_MODEL,
+    idea_from_ad_text_using_together_async,
+    idea_from_ad_thumbnail_using_together_async,
 )
-from meta_ad_library import search_meta_ads
+from http_client import close_async_session
+from meta_ad_library import search_meta_ads, stream_meta_ad_pages, META_ADS_COUNTRY
+from ad_corpus import ad_corpus
+from ad_prefilter import prefilter_candidates
+from ad_text import prepare_ad_copy
+from ad_dedup import AdDeduplicator
+from ad_images import thumbnail_data_url_async, THUMBNAIL_CONCURRENCY
+from metrics import log_sampled, cache_requests_total
+from tracing import span, traced
+import deadline
+from deadline import DeadlineExceeded
 
+MAX_ADS_TO_COLLECT = 5
+VALIDATION_CONCURRENCY = int(os.getenv("VALIDATION_CONCURRENCY", 8))
+IDEA_CONCURRENCY = int(os.getenv("IDEA_CONCURRENCY", 6))
+RELEVANCE_BATCHING = os.getenv("RELEVANCE_BATCHING", "true").lower() == "true"
+USE_SAMPLE_ADS = os.getenv("USE_SAMPLE_ADS", "true").lower() == "true"
+SAMPLE_ADS_PATH = "sample.json"
 
 
-def fetch_and_analyze_competitor_ads(product_name: str, company_name: str) -> list:
-    search_keyword = analyze_product_name(product_name, company_name)
-    print("Generated search keyword -> ", search_keyword)
+def extract_ad_candidate(ad_data: dict, company_name: str) -> dict | None:
+    """
+    Extracts the image url, ad copy and advertiser from a raw Meta ad.
 
-    # meta_ads = search_meta_ads(search_keyword)
+    Returns:
+        dict: Candidate ad in the response format, or None if the ad belongs to the
+        requesting company or has no usable image/text
+    """
+    # Skip ads from the requesting company
+    advertiser_name = ad_data.get("pageName")
+    if advertiser_name == company_name:
+        return None
 
-    # Loading example ad data
-    with open("sample.json", "r", encoding="utf-8") as file:
-        meta_ad_response = json.load(file)
+    # Extract ad media content
+    ad_snapshot = ad_data.get("snapshot", {})
+    ad_image_url = None
 
-    print("Retrieved Meta ads: ", meta_ad_response)
-    relevant_ads = []
-    continuation_token = meta_ad_response.get("continuation_token")
-    MAX_ADS_TO_COLLECT = 5
-    print("Analyzing ad content")
+    # Check primary images array
+    ad_images = ad_snapshot.get("images", [])
+    for image_data in ad_images:
+        ad_image_url = image_data.get("resized_image_url")
+        if ad_image_url:
+            break
 
-    while len(relevant_ads) < MAX_ADS_TO_COLLECT:
-        for ad_group in meta_ad_response.get("results", []):
-            for ad_data in ad_group:
+    # Fallback to cards array for image
+    if not ad_image_url:
+        ad_cards = ad_snapshot.get("cards", [])
+        if ad_cards:
+            first_card = ad_cards[0]
+            ad_image_url = first_card.get("resized_image_url")
+
+    if not ad_image_url:
+        return None
+
+    # Extract ad copy text
+    ad_body = ad_snapshot.get("body") or {}
+    ad_markup = ad_body.get("markup") or {}
+    ad_copy = ad_markup.get("__html")
+
+    if not ad_copy:
+        return None
+
+    return {
+        "image_url": ad_image_url,
+        "text": ad_copy,
+        "page_name": advertiser_name,
+        "collation_id": ad_data.get("collationID"),
+    }
+
+
+def extract_ad_candidates(meta_ad_response: dict, company_name: str) -> list:
+    """Flattens a Meta Ad Library page into candidate ads, keeping page order."""
+    candidates = []
+    for ad_group in meta_ad_response.get("results", []):
+        for ad_data in ad_group:
+            try:
+                candidate = extract_ad_candidate(ad_data, company_name)
+            except (KeyError, AttributeError) as e:
+                print(f"Skipping malformed ad data: {e}")
+                continue
+            if candidate:
+                candidates.append(candidate)
+    return candidates
+
+
+def _mark_partial(status: dict | None, error: BaseException | None = None):
+    """Records in status that results are missing because the deadline passed."""
+    if status is not None and (error is None or isinstance(error, DeadlineExceeded)):
+        status["partial"] = True
+
+
+async def iter_validated_ads(
+    candidates: list,
+    search_keyword: str,
+    max_relevant: int = MAX_ADS_TO_COLLECT,
+    max_workers: int = VALIDATION_CONCURRENCY,
+    batch: bool = RELEVANCE_BATCHING,
+    semaphore: asyncio.Semaphore | None = None,
+    status: dict | None = None,
+):
+    """
+    Runs relevance checks for candidate ads with bounded concurrency.
+
+    Checks are started in the given order, at most `max_workers` at a time. Relevant
+    ads are yielded as `(index, ad)` as soon as their check completes. Once
+    `max_relevant` ads are yielded, or the generator is closed, all outstanding
+    checks are cancelled.
+
+    Args:
+        candidates (list): Candidate ads, in the order they should be checked
+        search_keyword (str): Keyword the ads are validated against
+        max_relevant (int): Number of relevant ads after which validation stops
+        max_workers (int): Maximum number of concurrent relevance checks
+        batch (bool): Classify several ads per LLM call, chunked by token budget
+        semaphore (asyncio.Semaphore, optional): Concurrency budget shared with other
+            pipelines, used instead of max_workers
+        status (dict, optional): Gets "partial": True if the request deadline cut
+            off relevance checks
+    """
+    if not candidates or max_relevant <= 0:
+        return
+
+    semaphore = semaphore or asyncio.Semaphore(max(1, max_workers))
+    if batch:
+        # Chunk on the copy that is actually sent, not the raw (markup-heavy) text
+        ad_copies = [
+            prepare_ad_copy(ad["text"], TOGETHER_TEXT_MODEL) for ad in candidates
+        ]
+        chunks = chunk_ads_by_token_budget(ad_copies)
+    else:
+        chunks = [[index] for index in range(len(candidates))]
+
+    async def check(chunk: list) -> list:
+        async with semaphore:
+            with span("relevance_check", ads=len(chunk), first_index=chunk[0]):
+                if batch:
+                    return await validate_batch_with_together_ai_async(
+                        [ad_copies[index] for index in chunk],
+                        search_keyword,
+                        prepared=True,
+                    )
+                return [
+                    await validate_with_together_ai_async(
+                        candidates[chunk[0]]["text"], search_keyword
+                    )
+                ]
+
+    found = 0
+    pending = {asyncio.create_task(check(chunk)): chunk for chunk in chunks}
+    try:
+        while pending and found < max_relevant:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            # Ads completing in the same round are ordered by their position in candidates
+            for task in sorted(done, key=lambda task: pending[task][0]):
+                chunk = pending.pop(task)
                 try:
-                    # Skip ads from the requesting company
-                    advertiser_name = ad_data.get("pageName")
-                    if advertiser_name == company_name:
+                    verdicts = task.result()
+                except Exception as e:
+                    print(f"Relevance check failed for ads {chunk}: {e}")
+                    _mark_partial(status, e)
+                    continue
+                for index, verdict in zip(chunk, verdicts):
+                    if verdict != "yes" or found >= max_relevant:
                         continue
+                    found += 1
+                    print(
+                        f"Found relevant ad #{found} from advertiser {candidates[index]['page_name']}"
+                    )
+                    yield index, candidates[index]
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
 
-                    # Extract ad media content
-                    ad_snapshot = ad_data.get("snapshot", {})
-                    ad_image_url = None
-
-                    # Check primary images array
-                    ad_images = ad_snapshot.get("images", [])
-                    for image_data in ad_images:
-                        ad_image_url = image_data.get("resized_image_url")
-                        if ad_image_url:
-                            break
-
-                    # Fallback to cards array for image
-                    if not ad_image_url:
-                        ad_cards = ad_snapshot.get("cards", [])
-                        if ad_cards:
-                            first_card = ad_cards[0]
-                            ad_image_url = first_card.get("resized_image_url")
-
-                    if not ad_image_url:
-                        continue
 
-                    # Extract ad copy text
-                    ad_body = ad_snapshot.get("body", {})
-                    ad_markup = ad_body.get("markup", {})
-                    ad_copy = ad_markup.get("__html")
+async def validate_ads_concurrently(
+    candidates: list,
+    search_keyword: str,
+    max_relevant: int = MAX_ADS_TO_COLLECT,
+    max_workers: int = VALIDATION_CONCURRENCY,
+    batch: bool = RELEVANCE_BATCHING,
+) -> list:
+    """
+    Collects the relevant ads found by iter_validated_ads.
+
+    Returns:
+        list: Relevant ads in the order of candidates
+    """
+    relevant = []
+    async with aclosing(
+        iter_validated_ads(
+            candidates, search_keyword, max_relevant, max_workers, batch
+        )
+    ) as validated:
+        async for index, ad in validated:
+            relevant.append((index, ad))
+    return [ad for _, ad in sorted(relevant, key=lambda item: item[0])]
+
+
+_sample_query = None
+
+
+def _load_sample_page() -> dict:
+    # Example ad data is ingested into the corpus once and served from there
+    global _sample_query
+    if _sample_query is None:
+        _sample_query = ad_corpus.ingest_file(SAMPLE_ADS_PATH)[0]
+    return ad_corpus.get_page(_sample_query, max_age=None)
+
+
+def corpus_query(search_keyword: str, country_code: str = META_ADS_COUNTRY) -> str:
+    """Key of a keyword search in one market in the local ad corpus."""
+    return f"{search_keyword} [{country_code}]"
+
+
+@traced()
+async def fetch_first_ads_page(
+    search_keyword: str, country_code: str = META_ADS_COUNTRY
+) -> dict:
+    """
+    Returns the first page of ads to analyze for a keyword in one market.
+
+    Served from the local ad corpus while it is fresh; otherwise fetched from the
+    Meta Ad Library and stored. With USE_SAMPLE_ADS the example data is used.
+    """
+    if USE_SAMPLE_ADS:
+        return await asyncio.to_thread(_load_sample_page)
+
+    query = corpus_query(search_keyword, country_code)
+    meta_ad_response = await asyncio.to_thread(ad_corpus.get_page, query)
+    cache_requests_total.inc(
+        cache="ad_corpus", result="miss" if meta_ad_response is None else "hit"
+    )
+    if meta_ad_response is not None:
+        print(f"Serving '{search_keyword}' ({country_code}) from the local ad corpus")
+        # Following pages are searched for the keyword, not the corpus key
+        meta_ad_response["query"] = search_keyword
+        return meta_ad_response
 
-                    if not ad_copy:
+    meta_ad_response = await asyncio.to_thread(
+        search_meta_ads, search_keyword, "", country_code
+    )
+    await asyncio.to_thread(ad_corpus.ingest_page, meta_ad_response, query)
+    return meta_ad_response
+
+
+def _merge_pages(pages: list, seen_archive_ids: set) -> dict:
+    """Combines pages of several searches, dropping ads already seen by adArchiveID."""
+    results = []
+    for page in pages:
+        for ad_group in page.get("results") or []:
+            group = []
+            for ad_data in ad_group:
+                ad_archive_id = ad_data.get("adArchiveID")
+                if ad_archive_id is not None:
+                    if ad_archive_id in seen_archive_ids:
                         continue
+                    seen_archive_ids.add(ad_archive_id)
+                group.append(ad_data)
+            if group:
+                results.append(group)
+    return {"results": results}
 
-                    # Validate ad relevance
-                    if validate_with_together_ai(ad_copy, search_keyword):
-                        relevant_ads.append(
-                            {
-                                "image_url": ad_image_url,
-                                "text": ad_copy,
-                                "page_name": advertiser_name,
-                            }
-                        )
-                        print(
-                            f"Found relevant ad #{len(relevant_ads)} from advertiser {advertiser_name}"
-                        )
-
-                        if len(relevant_ads) >= MAX_ADS_TO_COLLECT:
-                            break
-
-                except KeyError as e:
-                    print(f"Skipping malformed ad data: {e}")
-                    continue
 
-            if len(relevant_ads) >= MAX_ADS_TO_COLLECT:
-                break
+async def iter_competitor_ads(
+    product_name: str,
+    company_name: str,
+    max_ads: int = MAX_ADS_TO_COLLECT,
+    countries: list | None = None,
+    keywords: list | None = None,
+    search_keyword: str | None = None,
+    semaphore: asyncio.Semaphore | None = None,
+    status: dict | None = None,
+):
+    """
+    Yields relevant competitor ads as soon as each one is validated.
 
-        if len(relevant_ads) >= MAX_ADS_TO_COLLECT or not continuation_token:
-            break
+    The generated search keyword and any extra keyword variants are searched in
+    every country concurrently. Page N of all searches is merged into one round of
+    candidates, deduplicated on adArchiveID. A search that fails is dropped
+    without stopping the others. Once the request deadline passes, the ads found
+    so far are kept and no further rounds start.
+
+    Items are `(position, ad)` where position is `(round, rank_in_round)`, so
+    callers that need a stable order can sort on it.
+
+    Args:
+        countries (list, optional): Country codes to search, defaults to META_ADS_COUNTRY
+        keywords (list, optional): Keyword variants searched besides the generated one
+        search_keyword (str, optional): Already generated keyword for product_name
+        semaphore (asyncio.Semaphore, optional): Concurrency budget for the relevance
+            checks, shared with other pipelines
+        status (dict, optional): Gets "partial": True if the request deadline cut
+            the search short
+    """
+    if search_keyword is None:
+        search_keyword = await analyze_product_name_async(product_name, company_name)
+        print("Generated search keyword -> ", search_keyword)
+
+    search_keywords = list(dict.fromkeys([search_keyword, *(keywords or [])]))
+    countries = list(dict.fromkeys(countries or [META_ADS_COUNTRY]))
+    searches = [
+        (keyword, country_code)
+        for keyword in search_keywords
+        for country_code in countries
+    ]
+    # The local pre-filter ranks against every keyword variant
+    prefilter_keyword = " ".join(search_keywords)
+
+    first_pages = await asyncio.gather(
+        *(fetch_first_ads_page(keyword, country) for keyword, country in searches),
+        return_exceptions=True,
+    )
+    if all(isinstance(page, Exception) for page in first_pages):
+        raise first_pages[0]
+
+    found = 0
+    seen_archive_ids = set()
+    deduplicator = AdDeduplicator()
+    print("Analyzing ad content")
+
+    async with AsyncExitStack() as stack:
+        streams = {}
+        for (keyword, country_code), first_page in zip(searches, first_pages):
+            if isinstance(first_page, Exception):
+                print(f"Search for '{keyword}' ({country_code}) failed: {first_page}")
+                _mark_partial(status, first_page)
+                continue
+            print(
+                f"Retrieved {len(first_page.get('results') or [])} Meta ad groups for '{first_page.get('query')}' ({country_code})"
+            )
+            # Following pages are prefetched while the current round is being validated
+            pages = await stack.enter_async_context(
+                aclosing(stream_meta_ad_pages(first_page, country_code=country_code))
+            )
+            streams[pages] = (keyword, country_code, first_page)
 
-        # Fetch next page of results if needed
-        if continuation_token:
-            meta_ad_response = search_meta_ads(
-                meta_ad_response["query"], continuation_token
+        round_number = 0
+        while streams and found < max_ads:
+            if deadline.expired():
+                # Keep the ads found so far rather than failing the whole request
+                print(f"Request deadline reached after {found} relevant ads")
+                _mark_partial(status)
+                break
+            round_pages = []
+            stream_list = list(streams)
+            next_pages = await asyncio.gather(
+                *(anext(pages, None) for pages in stream_list), return_exceptions=True
             )
-            continuation_token = meta_ad_response.get("continuation_token")
-            if not meta_ad_response.get("results"):
-                print("Retrying fetch due to empty response")
-                meta_ad_response = search_meta_ads(
-                    meta_ad_response["query"], continuation_token
+            for pages, page in zip(stream_list, next_pages):
+                keyword, country_code, first_page = streams[pages]
+                if page is None or isinstance(page, Exception):
+                    if page is not None:
+                        print(f"Search for '{keyword}' ({country_code}) failed: {page}")
+                        _mark_partial(status, page)
+                    del streams[pages]
+                    continue
+                if page is not first_page:
+                    await asyncio.to_thread(
+                        ad_corpus.ingest_page, page, corpus_query(keyword, country_code)
+                    )
+                round_pages.append(page)
+            if not round_pages:
+                break
+
+            # Variants of the same creative are checked once, then the cheap local
+            # ranking sends the likeliest ads to the LLM first
+            with span("prepare_candidates", round=round_number) as round_span:
+                candidates = deduplicator.collapse(
+                    extract_ad_candidates(
+                        _merge_pages(round_pages, seen_archive_ids), company_name
+                    )
+                )
+                candidates = prefilter_candidates(candidates, prefilter_keyword)
+                if round_span:
+                    round_span.set(pages=len(round_pages), candidates=len(candidates))
+            async with aclosing(
+                iter_validated_ads(
+                    candidates,
+                    search_keyword,
+                    max_relevant=max_ads - found,
+                    semaphore=semaphore,
+                    status=status,
                 )
+            ) as validated:
+                async for index, ad in validated:
+                    found += 1
+                    yield (round_number, index), ad
+            round_number += 1
 
     print("Ad analysis complete")
-    print("Collected ads: ", relevant_ads)
+
+
+async def fetch_and_analyze_competitor_ads_async(
+    product_name: str,
+    company_name: str,
+    countries: list | None = None,
+    keywords: list | None = None,
+    status: dict | None = None,
+) -> list:
+    relevant_ads = []
+    async with aclosing(
+        iter_competitor_ads(
+            product_name,
+            company_name,
+            countries=countries,
+            keywords=keywords,
+            status=status,
+        )
+    ) as ads:
+        async for position, ad in ads:
+            relevant_ads.append((position, ad))
+    relevant_ads = [ad for _, ad in sorted(relevant_ads, key=lambda item: item[0])]
+    log_sampled(
+        "competitor_ads_collected",
+        product_name=product_name,
+        count=len(relevant_ads),
+        advertisers=[ad["page_name"] for ad in relevant_ads],
+    )
     return relevant_ads
 
 
-def generate_ad_ideas(competitor_ads: list, product_name: str) -> list:
-    ad_ideas = []
+async def _with_closed_session(coro):
+    """Awaits coro and closes the pooled Together session before the loop goes away."""
+    try:
+        return await coro
+    finally:
+        await close_async_session()
+
+
+def fetch_and_analyze_competitor_ads(
+    product_name: str,
+    company_name: str,
+    countries: list | None = None,
+    keywords: list | None = None,
+) -> list:
+    """Sync wrapper around fetch_and_analyze_competitor_ads_async for scripts."""
+    return asyncio.run(
+        _with_closed_session(
+            fetch_and_analyze_competitor_ads_async(
+                product_name, company_name, countries, keywords
+            )
+        )
+    )
+
+
+async def _run_idea_call(
+    idea_fn, ad_value: str, product_name: str, semaphore, status: dict | None = None
+):
+    """Runs a single idea call, returning None instead of raising so one ad can't sink the batch."""
+    try:
+        async with semaphore:
+            return await idea_fn(ad_value, product_name)
+    except Exception as e:
+        print(f"Idea generation failed in {idea_fn.__name__}: {e}")
+        _mark_partial(status, e)
+        return None
+
+
+@traced()
+async def _ideate_ad(
+    ad: dict,
+    product_name: str,
+    semaphore,
+    thumbnail_semaphore,
+    status: dict | None = None,
+) -> dict:
+    """
+    Text and image idea of one competitor ad; a failed call leaves its prompt None.
+
+    status gets "partial": True if a prompt is None because the deadline passed.
+    """
 
-    for ad in competitor_ads:
-        generate_text_idea = idea_from_ad_text_using_together(ad["text"], product_name)
-        print("Generated text idea -> ", generate_text_idea)
-        generate_image_idea = idea_from_ad_image_using_together(
-            ad["image_url"], product_name
+    async def image_idea(image_url: str):
+        # Download and downscale outside the LLM slots, overlapping the text call
+        async with thumbnail_semaphore:
+            image_url = await thumbnail_data_url_async(image_url)
+        return await _run_idea_call(
+            idea_from_ad_thumbnail_using_together_async,
+            image_url,
+            product_name,
+            semaphore,
+            status,
         )
-        print("Generated image idea -> ", generate_image_idea)
-        ad_ideas.append(
-            {
-                "ad_text": ad["text"],
-                "image_url": ad["image_url"],
-                "text_prompt": generate_text_idea,
-                "image_prompt": generate_image_idea,
-            }
+
+    generate_text_idea, generate_image_idea = await asyncio.gather(
+        _run_idea_call(
+            idea_from_ad_text_using_together_async,
+            ad["text"],
+            product_name,
+            semaphore,
+            status,
+        ),
+        image_idea(ad["image_url"]),
+    )
+    log_sampled(
+        "ad_idea_generated",
+        advertiser=ad.get("page_name"),
+        text_idea_chars=len(str(generate_text_idea or "")),
+        image_idea_chars=len(str(generate_image_idea or "")),
+    )
+    return {
+        "ad_text": ad["text"],
+        "image_url": ad["image_url"],
+        "text_prompt": generate_text_idea,
+        "image_prompt": generate_image_idea,
+    }
+
+
+async def iter_ad_ideas(
+    competitor_ads: list,
+    product_name: str,
+    parallel: bool = True,
+    max_workers: int = IDEA_CONCURRENCY,
+    semaphore: asyncio.Semaphore | None = None,
+    status: dict | None = None,
+):
+    """
+    Generates text and image ideas for each competitor ad.
+
+    Yields `(index, idea)` as soon as both prompts of an ad are ready, where index
+    is the ad's position in competitor_ads. A failed call leaves its prompt as None
+    without dropping the ad.
+
+    Args:
+        competitor_ads (list): Ads as returned by fetch_and_analyze_competitor_ads
+        product_name (str): Product the ideas are adapted to
+        parallel (bool): Run all text and vision calls concurrently instead of one by one
+        max_workers (int): Maximum number of concurrent idea calls in parallel mode
+        semaphore (asyncio.Semaphore, optional): Concurrency budget shared with other
+            pipelines, used instead of parallel/max_workers
+        status (dict, optional): Gets "partial": True if the request deadline left
+            prompts None
+    """
+    semaphore = semaphore or asyncio.Semaphore(max(1, max_workers) if parallel else 1)
+    thumbnail_semaphore = asyncio.Semaphore(max(1, THUMBNAIL_CONCURRENCY))
+
+    async def ideate(index: int, ad: dict):
+        return index, await _ideate_ad(
+            ad, product_name, semaphore, thumbnail_semaphore, status
         )
 
+    tasks = [
+        asyncio.create_task(ideate(index, ad)) for index, ad in enumerate(competitor_ads)
+    ]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def generate_ad_ideas_async(
+    competitor_ads: list,
+    product_name: str,
+    parallel: bool = True,
+    max_workers: int = IDEA_CONCURRENCY,
+    semaphore: asyncio.Semaphore | None = None,
+    status: dict | None = None,
+) -> list:
+    """
+    Collects the ideas of iter_ad_ideas.
+
+    Returns:
+        list: One idea per competitor ad, in input order
+    """
+    ad_ideas = [None] * len(competitor_ads)
+    async with aclosing(
+        iter_ad_ideas(
+            competitor_ads, product_name, parallel, max_workers, semaphore, status
+        )
+    ) as ideas:
+        async for index, idea in ideas:
+            ad_ideas[index] = idea
     return ad_ideas
+
+
+async def iter_pipeline(
+    product_name: str,
+    company_name: str,
+    countries: list | None = None,
+    keywords: list | None = None,
+    max_workers: int = IDEA_CONCURRENCY,
+    status: dict | None = None,
+):
+    """
+    Finds competitor ads and generates their ideas in one overlapping pipeline.
+
+    Ideation of an ad starts the moment iter_competitor_ads accepts it, so the
+    validation of later ads runs alongside the idea calls of earlier ones. Yields
+    `("ad", position, ad)` for every accepted ad and `("idea", position, idea)` once
+    its ideas are ready, where position is the ad's position from
+    iter_competitor_ads.
+
+    Args:
+        max_workers (int): Maximum number of concurrent idea calls
+        status (dict, optional): Gets "partial": True if the request deadline cut
+            the search short or left prompts None
+    """
+    semaphore = asyncio.Semaphore(max(1, max_workers))
+    thumbnail_semaphore = asyncio.Semaphore(max(1, THUMBNAIL_CONCURRENCY))
+    events = asyncio.Queue()
+    idea_tasks = set()
+
+    async def ideate(position: tuple, ad: dict):
+        idea = None
+        try:
+            idea = await _ideate_ad(
+                ad, product_name, semaphore, thumbnail_semaphore, status
+            )
+        except Exception as e:
+            print(f"Idea generation failed for ad {position}: {e}")
+            _mark_partial(status, e)
+        # Every accepted ad gets exactly one idea event, even on failure
+        events.put_nowait(("idea", position, idea))
+
+    async def find_ads():
+        async with aclosing(
+            iter_competitor_ads(
+                product_name,
+                company_name,
+                countries=countries,
+                keywords=keywords,
+                status=status,
+            )
+        ) as ads:
+            async for position, ad in ads:
+                events.put_nowait(("ad", position, ad))
+                idea_tasks.add(asyncio.create_task(ideate(position, ad)))
+
+    producer = asyncio.create_task(find_ads())
+    producer.add_done_callback(lambda _: events.put_nowait(None))
+    try:
+        ads_found, ideas_sent, producer_done = 0, 0, False
+        while not producer_done or ideas_sent < ads_found:
+            event = await events.get()
+            if event is None:
+                producer_done = True
+                # Raises if the search failed, after the events queued before it
+                producer.result()
+                continue
+            if event[0] == "ad":
+                ads_found += 1
+            else:
+                ideas_sent += 1
+            yield event
+    finally:
+        for task in [producer, *idea_tasks]:
+            task.cancel()
+        await asyncio.gather(producer, *idea_tasks, return_exceptions=True)
+
+
+def generate_ad_ideas(
+    competitor_ads: list,
+    product_name: str,
+    parallel: bool = True,
+    max_workers: int = IDEA_CONCURRENCY,
+) -> list:
+    """Sync wrapper around generate_ad_ideas_async for scripts."""
+    return asyncio.run(
+        _with_closed_session(
+            generate_ad_ideas_async(competitor_ads, product_name, parallel, max_workers)
+        )
+    )
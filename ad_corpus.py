@@ -0,0 +1,260 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from dotenv import load_dotenv
+load_dotenv(override=True)
+
+AD_CORPUS_PATH = os.getenv("AD_CORPUS_PATH", ".cache/ad_corpus.sqlite3")
+AD_CORPUS_MAX_AGE = float(os.getenv("AD_CORPUS_MAX_AGE", 24 * 3600))
+
+
+def normalize_query(query: str) -> str:
+    return " ".join((query or "").lower().split())
+
+
+class AdCorpus:
+    """
+    Local store of every Meta ad we have fetched, deduplicated on adArchiveID.
+
+    Ads are indexed by the search keyword that returned them, the advertiser
+    pageName and the fetch time, so a search can be served locally while fresh
+    and only the pages beyond the stored continuation token go to RapidAPI.
+    """
+
+    def __init__(self, path: str = AD_CORPUS_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS ads (
+                    ad_archive_id TEXT PRIMARY KEY,
+                    page_name TEXT,
+                    collation_id TEXT,
+                    data TEXT NOT NULL,
+                    first_seen REAL NOT NULL,
+                    last_seen REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS ads_page_name ON ads (page_name);
+                CREATE INDEX IF NOT EXISTS ads_last_seen ON ads (last_seen);
+
+                CREATE TABLE IF NOT EXISTS query_ads (
+                    query TEXT NOT NULL,
+                    ad_archive_id TEXT NOT NULL,
+                    position INTEGER NOT NULL,
+                    fetched_at REAL NOT NULL,
+                    PRIMARY KEY (query, ad_archive_id)
+                );
+                CREATE INDEX IF NOT EXISTS query_ads_fetched ON query_ads (query, fetched_at);
+
+                CREATE TABLE IF NOT EXISTS query_state (
+                    query TEXT PRIMARY KEY,
+                    continuation_token TEXT,
+                    is_result_complete INTEGER NOT NULL DEFAULT 0,
+                    fetched_at REAL NOT NULL
+                );
+
+                CREATE TABLE IF NOT EXISTS ingested_files (
+                    digest TEXT PRIMARY KEY,
+                    path TEXT NOT NULL,
+                    queries TEXT NOT NULL,
+                    ingested_at REAL NOT NULL
+                );
+                """
+            )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def ingest_page(
+        self, page: dict, query: str | None = None, fetched_at: float | None = None
+    ) -> int:
+        """
+        Stores one Meta Ad Library response page.
+
+        Args:
+            page (dict): Response from search_meta_ads
+            query (str, optional): Keyword the page was fetched for, defaults to page["query"]
+            fetched_at (float, optional): Unix time of the fetch, defaults to now
+
+        Returns:
+            int: Number of ads not seen before
+        """
+        query = normalize_query(query or page.get("query"))
+        fetched_at = fetched_at or time.time()
+        new_ads = 0
+        with self._lock:
+            conn = self._connection()
+            position = conn.execute(
+                "SELECT COALESCE(MAX(position), -1) + 1 FROM query_ads WHERE query = ?",
+                (query,),
+            ).fetchone()[0]
+            for ad_group in page.get("results") or []:
+                for ad_data in ad_group:
+                    ad_archive_id = ad_data.get("adArchiveID")
+                    if not ad_archive_id:
+                        continue
+                    seen = conn.execute(
+                        "SELECT 1 FROM ads WHERE ad_archive_id = ?",
+                        (str(ad_archive_id),),
+                    ).fetchone()
+                    conn.execute(
+                        """INSERT INTO ads
+                        (ad_archive_id, page_name, collation_id, data, first_seen, last_seen)
+                        VALUES (?, ?, ?, ?, ?, ?)
+                        ON CONFLICT (ad_archive_id) DO UPDATE SET
+                            data = excluded.data, last_seen = excluded.last_seen""",
+                        (
+                            str(ad_archive_id),
+                            ad_data.get("pageName"),
+                            str(ad_data.get("collationID") or ""),
+                            json.dumps(ad_data, ensure_ascii=False),
+                            fetched_at,
+                            fetched_at,
+                        ),
+                    )
+                    existing = conn.execute(
+                        "SELECT 1 FROM query_ads WHERE query = ? AND ad_archive_id = ?",
+                        (query, str(ad_archive_id)),
+                    ).fetchone()
+                    if existing:
+                        conn.execute(
+                            "UPDATE query_ads SET fetched_at = ? WHERE query = ? AND ad_archive_id = ?",
+                            (fetched_at, query, str(ad_archive_id)),
+                        )
+                    else:
+                        conn.execute(
+                            "INSERT INTO query_ads (query, ad_archive_id, position, fetched_at) VALUES (?, ?, ?, ?)",
+                            (query, str(ad_archive_id), position, fetched_at),
+                        )
+                        position += 1
+                    new_ads += seen is None
+            conn.execute(
+                """INSERT OR REPLACE INTO query_state
+                (query, continuation_token, is_result_complete, fetched_at) VALUES (?, ?, ?, ?)""",
+                (
+                    query,
+                    page.get("continuation_token"),
+                    int(bool(page.get("is_result_complete"))),
+                    fetched_at,
+                ),
+            )
+            conn.commit()
+        return new_ads
+
+    def ingest_file(self, path: str, query: str | None = None) -> list:
+        """
+        Bulk-ingests a saved response file (a single page like sample.json, or a list of pages).
+
+        Files are recorded by content hash, so ingesting the same file again is a no-op.
+
+        Returns:
+            list: Normalized queries the file's ads are stored under
+        """
+        with open(path, "rb") as file:
+            raw = file.read()
+        digest = hashlib.sha256(raw).hexdigest()
+        with self._lock:
+            row = (
+                self._connection()
+                .execute("SELECT queries FROM ingested_files WHERE digest = ?", (digest,))
+                .fetchone()
+            )
+        if row is not None:
+            return json.loads(row[0])
+
+        pages = json.loads(raw)
+        if isinstance(pages, dict):
+            pages = [pages]
+        fetched_at = os.path.getmtime(path)
+        queries = []
+        for page in pages:
+            self.ingest_page(page, query, fetched_at)
+            page_query = normalize_query(query or page.get("query"))
+            if page_query not in queries:
+                queries.append(page_query)
+
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                """INSERT OR REPLACE INTO ingested_files
+                (digest, path, queries, ingested_at) VALUES (?, ?, ?, ?)""",
+                (digest, path, json.dumps(queries), time.time()),
+            )
+            conn.commit()
+        return queries
+
+    def get_page(self, query: str, max_age: float | None = AD_CORPUS_MAX_AGE) -> dict | None:
+        """
+        Builds a response page from the stored ads of a query.
+
+        Returns:
+            dict: Page shaped like a search_meta_ads response whose continuation_token
+            resumes after the last stored page, or None if the query was never
+            fetched or is older than max_age seconds
+        """
+        query = normalize_query(query)
+        with self._lock:
+            conn = self._connection()
+            state = conn.execute(
+                "SELECT continuation_token, is_result_complete, fetched_at FROM query_state WHERE query = ?",
+                (query,),
+            ).fetchone()
+            if state is None or (
+                max_age is not None and state[2] < time.time() - max_age
+            ):
+                return None
+            rows = conn.execute(
+                """SELECT ads.data FROM query_ads
+                JOIN ads ON ads.ad_archive_id = query_ads.ad_archive_id
+                WHERE query_ads.query = ? ORDER BY query_ads.position""",
+                (query,),
+            ).fetchall()
+
+        return {
+            "query": query,
+            "continuation_token": state[0],
+            "is_result_complete": bool(state[1]),
+            "number_of_ads": len(rows),
+            "results": [[json.loads(row[0])] for row in rows],
+        }
+
+    def get_ads_by_page_name(self, page_name: str) -> list:
+        """Returns every stored ad of an advertiser, most recently seen first."""
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT data FROM ads WHERE page_name = ? ORDER BY last_seen DESC",
+                (page_name,),
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def get_ads_seen_since(self, timestamp: float) -> list:
+        """Returns ads fetched at or after timestamp, most recent first."""
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT data FROM ads WHERE last_seen >= ? ORDER BY last_seen DESC",
+                (timestamp,),
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+
+ad_corpus = AdCorpus()
+
+
+if __name__ == "__main__":
+    # Bulk offline ingest: python ad_corpus.py sample.json saved_pages/*.json
+    import sys
+
+    for saved_path in sys.argv[1:]:
+        print(f"{saved_path}: stored under {ad_corpus.ingest_file(saved_path)}")
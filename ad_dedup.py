@@ -0,0 +1,114 @@
+import os
+import zlib
+import hashlib
+import numpy as np
+from dotenv import load_dotenv
+from ad_prefilter import strip_ad_markup
+load_dotenv(override=True)
+
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "true").lower() == "true"
+DEDUP_SIMILARITY = float(os.getenv("DEDUP_SIMILARITY", 0.8))
+MINHASH_PERMUTATIONS = 64
+SHINGLE_SIZE = 3
+
+# (a * hash + b) % p over the whole field of p = 2^31 - 1: with hashes reduced
+# mod p first, a * hash + b stays below 2^62 and never wraps around in uint64
+_MERSENNE_PRIME = np.uint64((1 << 31) - 1)
+_rng = np.random.default_rng(seed=1)
+_PERMUTATION_A = _rng.integers(
+    1, _MERSENNE_PRIME, MINHASH_PERMUTATIONS, dtype=np.uint64
+)
+_PERMUTATION_B = _rng.integers(
+    0, _MERSENNE_PRIME, MINHASH_PERMUTATIONS, dtype=np.uint64
+)
+
+
+def minhash_signature(text: str) -> np.ndarray:
+    """MinHash signature over word shingles of the plain ad text."""
+    words = text.split()
+    if len(words) < SHINGLE_SIZE:
+        shingles = {" ".join(words)}
+    else:
+        shingles = {
+            " ".join(words[start : start + SHINGLE_SIZE])
+            for start in range(len(words) - SHINGLE_SIZE + 1)
+        }
+    hashes = (
+        np.array(
+            [zlib.crc32(shingle.encode("utf-8")) for shingle in shingles],
+            dtype=np.uint64,
+        )
+        % _MERSENNE_PRIME
+    )
+    permuted = (np.outer(hashes, _PERMUTATION_A) + _PERMUTATION_B) % _MERSENNE_PRIME
+    return permuted.min(axis=0)
+
+
+class AdDeduplicator:
+    """
+    Collapses duplicate competitor ads, keeping the first ad of each group.
+
+    Exact duplicates share a collationID or the same plain text; near-duplicates
+    have an estimated Jaccard similarity of their ad copy shingles of at least
+    `similarity`. State is kept across calls so variants on later pages collapse
+    into groups found on earlier ones. Representatives carry a "group_size".
+    """
+
+    def __init__(self, similarity: float = DEDUP_SIMILARITY):
+        self.similarity = similarity
+        self.representatives = []
+        self._exact_keys = {}
+        self._signatures = np.empty((0, MINHASH_PERMUTATIONS), dtype=np.uint64)
+
+    def _join(self, group: int, exact_keys: list) -> None:
+        self.representatives[group]["group_size"] += 1
+        for key in exact_keys:
+            self._exact_keys.setdefault(key, group)
+
+    def collapse(self, candidates: list) -> list:
+        """
+        Returns the candidates that start a new group, in input order.
+
+        Args:
+            candidates (list): Candidate ads with "text" and optional "collation_id"
+        """
+        if not DEDUP_ENABLED:
+            return candidates
+
+        unique = []
+        for ad in candidates:
+            plain_text = strip_ad_markup(ad["text"])
+            exact_keys = ["text:" + hashlib.sha1(plain_text.encode("utf-8")).hexdigest()]
+            if ad.get("collation_id"):
+                exact_keys.append(f"collation:{ad['collation_id']}")
+
+            group = next(
+                (self._exact_keys[key] for key in exact_keys if key in self._exact_keys),
+                None,
+            )
+            if group is not None:
+                self._join(group, exact_keys)
+                continue
+
+            signature = minhash_signature(plain_text)
+            if len(self._signatures):
+                similarities = (self._signatures == signature).mean(axis=1)
+                best = int(similarities.argmax())
+                if similarities[best] >= self.similarity:
+                    self._join(best, exact_keys)
+                    continue
+
+            ad["group_size"] = 1
+            group = len(self.representatives)
+            self.representatives.append(ad)
+            self._signatures = np.vstack([self._signatures, signature])
+            for key in exact_keys:
+                self._exact_keys[key] = group
+            unique.append(ad)
+
+        if len(unique) < len(candidates):
+            print(
+                f"Collapsed {len(candidates)} ads into {len(unique)} new groups, "
+                f"group sizes: {[ad['group_size'] for ad in self.representatives]}"
+            )
+        return unique
@@ -0,0 +1,140 @@
+import os
+import io
+import base64
+import asyncio
+import hashlib
+import aiohttp
+from PIL import Image
+import http_client
+import deadline
+from single_flight import SingleFlight
+from metrics import cache_requests_total
+from dotenv import load_dotenv
+load_dotenv(override=True)
+
+THUMBNAILS_ENABLED = os.getenv("THUMBNAILS_ENABLED", "true").lower() == "true"
+THUMBNAIL_MAX_DIMENSION = int(os.getenv("THUMBNAIL_MAX_DIMENSION", 512))
+THUMBNAIL_QUALITY = int(os.getenv("THUMBNAIL_QUALITY", 80))
+THUMBNAIL_CACHE_DIR = os.getenv("THUMBNAIL_CACHE_DIR", ".cache/thumbnails")
+THUMBNAIL_CACHE_MAX_BYTES = int(
+    os.getenv("THUMBNAIL_CACHE_MAX_BYTES", 128 * 1024 * 1024)
+)
+THUMBNAIL_CONCURRENCY = int(os.getenv("THUMBNAIL_CONCURRENCY", 8))
+THUMBNAIL_TIMEOUT = float(os.getenv("THUMBNAIL_TIMEOUT", 15))
+
+# Concurrent requests for the same image share one download
+thumbnail_flight = SingleFlight("thumbnails")
+
+
+def _thumbnail_path(image_url: str) -> str:
+    name = hashlib.sha256(image_url.encode("utf-8")).hexdigest()
+    return os.path.join(THUMBNAIL_CACHE_DIR, f"{name}.jpg")
+
+
+def downscale_image(
+    image_bytes: bytes,
+    max_dimension: int = THUMBNAIL_MAX_DIMENSION,
+    quality: int = THUMBNAIL_QUALITY,
+) -> bytes:
+    """Re-encodes an image as JPEG whose longer side is at most max_dimension pixels."""
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        image = image.convert("RGB")
+        image.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
+        output = io.BytesIO()
+        image.save(output, format="JPEG", quality=quality, optimize=True)
+    return output.getvalue()
+
+
+def _evict_thumbnails():
+    """Deletes the least recently written thumbnails once the cache exceeds its size limit."""
+    files = []
+    for name in os.listdir(THUMBNAIL_CACHE_DIR):
+        if name.endswith(".jpg"):
+            path = os.path.join(THUMBNAIL_CACHE_DIR, name)
+            stat = os.stat(path)
+            files.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= THUMBNAIL_CACHE_MAX_BYTES:
+            break
+        os.remove(path)
+        total -= size
+
+
+def _load_thumbnail(image_url: str) -> bytes | None:
+    path = _thumbnail_path(image_url)
+    if not os.path.exists(path):
+        cache_requests_total.inc(cache="thumbnail", result="miss")
+        return None
+    cache_requests_total.inc(cache="thumbnail", result="hit")
+    with open(path, "rb") as file:
+        return file.read()
+
+
+def _store_thumbnail(image_url: str, image_bytes: bytes) -> bytes:
+    """Downscales a downloaded image and writes it to the thumbnail cache."""
+    thumbnail = downscale_image(image_bytes)
+    os.makedirs(THUMBNAIL_CACHE_DIR, exist_ok=True)
+    path = _thumbnail_path(image_url)
+    # Write then rename so concurrent readers never see a partial file
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as file:
+        file.write(thumbnail)
+    os.replace(tmp_path, path)
+    _evict_thumbnails()
+    return thumbnail
+
+
+def _data_url(thumbnail: bytes) -> str:
+    return "data:image/jpeg;base64," + base64.b64encode(thumbnail).decode()
+
+
+def thumbnail_data_url(image_url: str) -> str:
+    """
+    Returns an ad image as an inline base64 JPEG thumbnail for vision prompts.
+
+    Thumbnails are cached on disk by URL hash, so an ad image can still be analyzed
+    after its CDN URL expired. Falls back to the remote URL when the image can't be
+    downloaded or decoded, or THUMBNAILS_ENABLED is off.
+    """
+    if not THUMBNAILS_ENABLED or not image_url or image_url.startswith("data:"):
+        return image_url
+    try:
+        thumbnail = _load_thumbnail(image_url)
+        if thumbnail is None:
+
+            def fetch():
+                response = http_client.get(image_url, timeout=THUMBNAIL_TIMEOUT)
+                response.raise_for_status()
+                return _store_thumbnail(image_url, response.content)
+
+            thumbnail = thumbnail_flight.call(image_url, fetch)
+        return _data_url(thumbnail)
+    except Exception as e:
+        print(f"Thumbnail preparation failed for {image_url}: {e}")
+        return image_url
+
+
+async def thumbnail_data_url_async(image_url: str) -> str:
+    """Async variant of thumbnail_data_url; decoding and resizing run in a thread."""
+    if not THUMBNAILS_ENABLED or not image_url or image_url.startswith("data:"):
+        return image_url
+    try:
+        thumbnail = await asyncio.to_thread(_load_thumbnail, image_url)
+        if thumbnail is None:
+
+            async def fetch():
+                timeout = deadline.capped(THUMBNAIL_TIMEOUT, "thumbnail download")
+                session = await http_client.get_async_session()
+                async with session.get(
+                    image_url, timeout=aiohttp.ClientTimeout(total=timeout)
+                ) as response:
+                    response.raise_for_status()
+                    image_bytes = await response.read()
+                return await asyncio.to_thread(_store_thumbnail, image_url, image_bytes)
+
+            thumbnail = await thumbnail_flight.do(image_url, fetch)
+        return _data_url(thumbnail)
+    except Exception as e:
+        print(f"Thumbnail preparation failed for {image_url}: {e}")
+        return image_url
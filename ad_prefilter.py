@@ -0,0 +1,90 @@
+import os
+import re
+import html
+import zlib
+import numpy as np
+from dotenv import load_dotenv
+load_dotenv(override=True)
+
+PREFILTER_ENABLED = os.getenv("PREFILTER_ENABLED", "true").lower() == "true"
+PREFILTER_THRESHOLD = float(os.getenv("PREFILTER_THRESHOLD", 0.02))
+PREFILTER_DIMENSIONS = 2**14
+
+_TAG_RE = re.compile(r"<[^>]+>")
+_NON_WORD_RE = re.compile(r"[^\w]+")
+
+
+def strip_ad_markup(ad_html: str) -> str:
+    """Converts Meta ad body markup to plain lowercase text."""
+    text = html.unescape(_TAG_RE.sub(" ", ad_html or ""))
+    return " ".join(text.lower().split())
+
+
+def _hashed_ngrams(text: str) -> list:
+    """Hashed character 3/4-grams of each word, so '#WhiteSesameOil' still matches 'sesame'."""
+    indexes = []
+    for word in _NON_WORD_RE.split(text):
+        if not word:
+            continue
+        padded = f" {word} "
+        for size in (3, 4):
+            for start in range(len(padded) - size + 1):
+                gram = padded[start : start + size].encode("utf-8")
+                indexes.append(zlib.crc32(gram) % PREFILTER_DIMENSIONS)
+    return indexes
+
+
+def score_ads(ad_texts: list, keyword: str) -> np.ndarray:
+    """
+    Scores ad texts by TF-IDF cosine similarity to the keyword.
+
+    All ads of a page are vectorized at once; IDF is computed over the page so
+    n-grams shared by every ad (e.g. boilerplate hashtags) carry little weight.
+
+    Returns:
+        np.ndarray: One similarity in [0, 1] per ad text
+    """
+    if not ad_texts:
+        return np.zeros(0)
+
+    documents = [strip_ad_markup(text) for text in ad_texts] + [
+        strip_ad_markup(keyword)
+    ]
+    counts = np.zeros((len(documents), PREFILTER_DIMENSIONS), dtype=np.float32)
+    for row, document in enumerate(documents):
+        np.add.at(counts[row], _hashed_ngrams(document), 1.0)
+
+    document_frequency = np.count_nonzero(counts, axis=0)
+    idf = np.log((1 + len(documents)) / (1 + document_frequency)) + 1.0
+    vectors = np.log1p(counts) * idf
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors = np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+    return vectors[:-1] @ vectors[-1]
+
+
+def prefilter_candidates(
+    candidates: list, keyword: str, threshold: float = PREFILTER_THRESHOLD
+) -> list:
+    """
+    Ranks candidate ads by similarity to the keyword and drops those below threshold.
+
+    Args:
+        candidates (list): Candidate ads with a "text" key
+        keyword (str): Search keyword the ads are checked against
+        threshold (float): Minimum similarity for an ad to reach the LLM
+
+    Returns:
+        list: Remaining candidates, best scoring first (page order for ties)
+    """
+    if not PREFILTER_ENABLED or not candidates:
+        return candidates
+
+    scores = score_ads([ad["text"] for ad in candidates], keyword)
+    # Stable sort keeps page order among equal scores
+    ranked = np.argsort(-scores, kind="stable")
+    kept = [candidates[index] for index in ranked if scores[index] >= threshold]
+    print(
+        f"Pre-filter kept {len(kept)} of {len(candidates)} ads for the relevance check"
+    )
+    return kept
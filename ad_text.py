@@ -0,0 +1,107 @@
+import os
+import re
+import html
+import threading
+from dotenv import load_dotenv
+load_dotenv(override=True)
+
+AD_COPY_PREPROCESSING = os.getenv("AD_COPY_PREPROCESSING", "true").lower() == "true"
+AD_COPY_TOKEN_BUDGET = int(os.getenv("AD_COPY_TOKEN_BUDGET", 256))
+AD_COPY_MAX_HASHTAGS = int(os.getenv("AD_COPY_MAX_HASHTAGS", 5))
+
+# Ad copy token budget per model; models not listed use AD_COPY_TOKEN_BUDGET
+AD_COPY_MODEL_TOKEN_BUDGETS = {
+    "meta-llama/Meta-Llama-3.1-8B-Instruct-Turbo": AD_COPY_TOKEN_BUDGET,
+    "meta-llama/Meta-Llama-3.1-70B-Instruct-Turbo": AD_COPY_TOKEN_BUDGET * 2,
+}
+
+_BREAK_RE = re.compile(r"<br\s*/?>|</p>|</div>", re.IGNORECASE)
+_TAG_RE = re.compile(r"<[^>]+>")
+_SPACES_RE = re.compile(r"[ \t\u00a0\u200b]+")
+_BLANK_LINES_RE = re.compile(r"\n{3,}")
+_HASHTAG_RE = re.compile(r"#\w+")
+_EMOJI = "[\U0001F1E6-\U0001FAFF\u2600-\u27BF\u2B00-\u2BFF]"
+_EMOJI_RUN_RE = re.compile(f"({_EMOJI})(?:[\ufe0f\u200d]*{_EMOJI}|\ufe0f)*")
+
+_stats = {"ads": 0, "tokens_before": 0, "tokens_after": 0, "truncated": 0}
+_stats_lock = threading.Lock()
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count for Llama tokenizers (~4 characters per token)."""
+    return len(text) // 4 + 1
+
+
+def _limit_hashtags(text: str, max_hashtags: int) -> str:
+    """Keeps the first max_hashtags distinct hashtags and drops repeats and the rest."""
+    seen = set()
+
+    def keep(match):
+        tag = match.group(0).lower()
+        if tag in seen or len(seen) >= max_hashtags:
+            return ""
+        seen.add(tag)
+        return match.group(0)
+
+    return _HASHTAG_RE.sub(keep, text)
+
+
+def clean_ad_copy(ad_html: str, max_hashtags: int = AD_COPY_MAX_HASHTAGS) -> str:
+    """
+    Converts Meta ad body markup to compact plain text for prompting.
+
+    Tags are removed (line breaks kept), HTML entities decoded, runs of emoji
+    collapsed to their first emoji, boilerplate hashtags capped and whitespace
+    normalized. Unlike ad_prefilter.strip_ad_markup the case and line structure
+    of the copy are preserved.
+    """
+    text = _BREAK_RE.sub("\n", ad_html or "")
+    text = html.unescape(_TAG_RE.sub(" ", text))
+    text = _EMOJI_RUN_RE.sub(r"\1", text)
+    text = _limit_hashtags(text, max_hashtags)
+    lines = [_SPACES_RE.sub(" ", line).strip() for line in text.splitlines()]
+    return _BLANK_LINES_RE.sub("\n\n", "\n".join(lines)).strip()
+
+
+def truncate_to_token_budget(text: str, token_budget: int) -> str:
+    """Cuts text at a word boundary so that estimate_tokens(text) stays within the budget."""
+    if estimate_tokens(text) <= token_budget:
+        return text
+    max_chars = max(0, (token_budget - 1) * 4 - 1)
+    cut = text[:max_chars]
+    if " " in cut:
+        cut = cut[: cut.rfind(" ")]
+    return cut.rstrip() + "…"
+
+
+def prepare_ad_copy(ad_html: str, model: str | None = None) -> str:
+    """
+    Cleans ad copy and truncates it to the token budget of the model it is sent to.
+
+    Args:
+        ad_html (str): Ad copy as returned by the Meta Ad Library (may contain markup)
+        model (str, optional): Model the prompt is sent to, selects the token budget
+
+    Returns:
+        str: Prompt-ready ad copy (unchanged if AD_COPY_PREPROCESSING is off)
+    """
+    if not AD_COPY_PREPROCESSING:
+        return ad_html
+    token_budget = AD_COPY_MODEL_TOKEN_BUDGETS.get(model, AD_COPY_TOKEN_BUDGET)
+    cleaned = clean_ad_copy(ad_html)
+    prepared = truncate_to_token_budget(cleaned, token_budget)
+
+    with _stats_lock:
+        _stats["ads"] += 1
+        _stats["tokens_before"] += estimate_tokens(ad_html or "")
+        _stats["tokens_after"] += estimate_tokens(prepared)
+        _stats["truncated"] += prepared != cleaned
+    return prepared
+
+
+def preprocessing_stats() -> dict:
+    """Estimated prompt tokens saved by ad copy preprocessing in this process."""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["tokens_saved"] = stats["tokens_before"] - stats["tokens_after"]
+    return stats
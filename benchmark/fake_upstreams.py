@@ -0,0 +1,274 @@
+import io
+import re
+import copy
+import json
+import math
+import random
+import asyncio
+import hashlib
+from collections import Counter
+from aiohttp import web
+from PIL import Image
+
+# Latency (lognormal around the median, in seconds) and failure rates per upstream
+DEFAULT_PROFILES = {
+    upstream: {
+        "latency_median": latency_median,
+        "latency_sigma": latency_sigma,
+        "error_rate": 0.0,
+        "throttle_rate": 0.0,
+    }
+    for upstream, latency_median, latency_sigma in [
+        ("together", 0.8, 0.5),
+        ("rapidapi", 1.5, 0.4),
+        ("recraft", 6.0, 0.3),
+        ("cdn", 0.05, 0.3),
+    ]
+}
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+_AD_NUMBER_RE = re.compile(r"^\s*Ad (\d+):", re.MULTILINE)
+
+
+def _filler(seed: str, min_length: int = 0) -> str:
+    words = ["fresh", "pure", "natural", "daily", "offer", "quality", "taste", "family"]
+    rng = random.Random(seed)
+    text = " ".join(rng.choice(words) for _ in range(8))
+    while len(text) < min_length:
+        text += " " + rng.choice(words)
+    return text
+
+
+class FakeUpstreams:
+    """
+    Local stand-ins for Together AI chat completions, the RapidAPI Meta Ad Library
+    and Recraft, plus a CDN serving the ad and generated images.
+
+    Routes are mounted under /together/v1, /rapidapi, /recraft/v1 and /cdn so that
+    TOGETHER_BASE_URL, META_ADS_API_URL and RECRAFT_API_URL can point at one server.
+    Ad pages replay sample.json with ad ids and image URLs made unique per keyword
+    and page. Chat answers are built from the JSON schema of the request.
+
+    Args:
+        sample_path (str): Meta Ad Library response replayed as every page
+        profiles (dict, optional): Overrides of DEFAULT_PROFILES per upstream
+        pages (int): Pages per search before the continuation token runs out
+        relevant_rate (float): Share of ads judged relevant
+        confident_rate (float): Share of verdicts of the small cascade model
+            answered with high confidence (larger models are always confident)
+        seed (int, optional): Seed for reproducible latencies and answers
+    """
+
+    def __init__(
+        self,
+        sample_path: str,
+        profiles: dict | None = None,
+        pages: int = 3,
+        relevant_rate: float = 0.6,
+        confident_rate: float = 0.8,
+        seed: int | None = None,
+    ):
+        with open(sample_path, "r", encoding="utf-8") as file:
+            self.sample = json.load(file)
+        self.profiles = copy.deepcopy(DEFAULT_PROFILES)
+        for name, overrides in (profiles or {}).items():
+            self.profiles[name].update(overrides)
+        self.pages = pages
+        self.relevant_rate = relevant_rate
+        self.confident_rate = confident_rate
+        self.random = random.Random(seed)
+        self.calls = Counter()
+        self.base_url = None
+        self._runner = None
+        self._image = self._render_image()
+
+    @staticmethod
+    def _render_image() -> bytes:
+        # A gradient compresses like a photo rather than a flat color
+        image = Image.linear_gradient("L").resize((1080, 1080)).convert("RGB")
+        output = io.BytesIO()
+        image.save(output, format="JPEG", quality=85)
+        return output.getvalue()
+
+    def reset_calls(self):
+        self.calls.clear()
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        app = web.Application(client_max_size=32 * 1024 * 1024)
+        app.router.add_post("/together/v1/chat/completions", self._chat_completion)
+        app.router.add_get("/rapidapi/search/ads", self._search_ads)
+        app.router.add_post("/recraft/v1/images/generations", self._generate_images)
+        app.router.add_get("/cdn/{name}", self._cdn_image)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://{host}:{port}"
+        return self.base_url
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    async def _simulate(self, upstream: str) -> web.Response | None:
+        """Waits out a sampled latency; returns an error response for failed calls."""
+        profile = self.profiles[upstream]
+        latency = profile["latency_median"] * math.exp(
+            self.random.gauss(0, profile["latency_sigma"])
+        )
+        await asyncio.sleep(latency)
+        roll = self.random.random()
+        if roll < profile["throttle_rate"]:
+            self.calls[(upstream, 429)] += 1
+            return web.json_response(
+                {"error": "rate limited"}, status=429, headers={"Retry-After": "1"}
+            )
+        if roll < profile["throttle_rate"] + profile["error_rate"]:
+            self.calls[(upstream, 500)] += 1
+            return web.json_response({"error": "simulated failure"}, status=500)
+        self.calls[(upstream, 200)] += 1
+        return None
+
+    # Together AI
+
+    def _answer(
+        self, schema: dict, defs: dict, prompt: str, model: str, path: str = ""
+    ):
+        if "$ref" in schema:
+            definition = defs[schema["$ref"].split("/")[-1]]
+            return self._answer(definition, defs, prompt, model, path)
+        if "enum" in schema:
+            if set(schema["enum"]) == {"yes", "no"}:
+                return "yes" if self.random.random() < self.relevant_rate else "no"
+            return schema["enum"][0]
+        if schema.get("type") == "object":
+            return {
+                name: self._answer(field, defs, prompt, model, name)
+                for name, field in schema.get("properties", {}).items()
+            }
+        if schema.get("type") == "array":
+            # One item per ad listed in a batch prompt
+            numbers = [int(number) for number in _AD_NUMBER_RE.findall(prompt)] or [1]
+            items = [
+                self._answer(schema["items"], defs, prompt, model) for _ in numbers
+            ]
+            for number, item in zip(numbers, items):
+                if isinstance(item, dict) and "ad_number" in item:
+                    item["ad_number"] = number
+            return items
+        if schema.get("type") == "integer":
+            return 1
+        if path == "keyword":
+            # Distinct products search distinct keywords that still match the
+            # replayed ads, so the local pre-filter behaves as on real searches
+            suffix = hashlib.sha1(prompt.encode()).hexdigest()[:6]
+            return f"{self.sample.get('query', 'benchmark')} {suffix}"
+        return _filler(prompt + model, schema.get("minLength", 0))
+
+    def _logprobs(self, content: str, model: str) -> dict:
+        tokens = _TOKEN_RE.findall(content)
+        small_model = "3B" in model
+        logprobs = []
+        for token in tokens:
+            if token.lower() in ("yes", "no"):
+                confident = (
+                    not small_model or self.random.random() < self.confident_rate
+                )
+                logprobs.append(math.log(0.98 if confident else 0.6))
+            else:
+                logprobs.append(math.log(0.99))
+        return {"tokens": tokens, "token_logprobs": logprobs}
+
+    async def _chat_completion(self, request: web.Request) -> web.Response:
+        payload = await request.json()
+        error = await self._simulate("together")
+        if error is not None:
+            return error
+        model = payload.get("model", "")
+        content = payload["messages"][-1]["content"]
+        if isinstance(content, list):
+            prompt = " ".join(part.get("text", "") for part in content)
+        else:
+            prompt = content
+        schema = (payload.get("response_format") or {}).get("schema")
+        if schema:
+            answer = json.dumps(
+                self._answer(schema, schema.get("$defs", {}), prompt, model)
+            )
+        else:
+            answer = _filler(prompt + model, 200)
+        choice = {"index": 0, "message": {"role": "assistant", "content": answer}}
+        if payload.get("logprobs"):
+            choice["logprobs"] = self._logprobs(answer, model)
+        return web.json_response(
+            {
+                "id": "benchmark",
+                "model": model,
+                "choices": [choice],
+                "usage": {
+                    "prompt_tokens": len(prompt) // 4 + 1,
+                    "completion_tokens": len(answer) // 4 + 1,
+                },
+            }
+        )
+
+    # Meta Ad Library
+
+    def _page(self, query: str, country_code: str, page_number: int) -> dict:
+        page = copy.deepcopy(self.sample)
+        suffix = hashlib.sha1(f"{query}|{page_number}".encode()).hexdigest()[:6]
+        for group in page.get("results") or []:
+            for ad in group if isinstance(group, list) else [group]:
+                ad["adArchiveID"] = f"{ad.get('adArchiveID')}{suffix}"
+                snapshot = ad.get("snapshot") or {}
+                for image in [*snapshot.get("images", []), *snapshot.get("cards", [])]:
+                    for field in ("resized_image_url", "original_image_url"):
+                        if image.get(field):
+                            image[field] = (
+                                f"{self.base_url}/cdn/{ad['adArchiveID']}.jpg"
+                            )
+        page["query"] = query
+        page["country_code"] = country_code
+        page["continuation_token"] = (
+            f"page-{page_number + 1}" if page_number < self.pages else None
+        )
+        page["is_result_complete"] = page_number >= self.pages
+        return page
+
+    async def _search_ads(self, request: web.Request) -> web.Response:
+        error = await self._simulate("rapidapi")
+        if error is not None:
+            return error
+        token = request.query.get("continuation_token") or "page-1"
+        page_number = int(token.removeprefix("page-") or 1)
+        return web.json_response(
+            self._page(
+                request.query.get("query", ""),
+                request.query.get("country_code", ""),
+                page_number,
+            )
+        )
+
+    # Recraft and image CDN
+
+    async def _generate_images(self, request: web.Request) -> web.Response:
+        payload = await request.json()
+        error = await self._simulate("recraft")
+        if error is not None:
+            return error
+        name = hashlib.sha1(payload.get("prompt", "").encode()).hexdigest()[:12]
+        return web.json_response(
+            {
+                "data": [
+                    {"url": f"{self.base_url}/cdn/recraft-{name}-{index}.jpg"}
+                    for index in range(int(payload.get("n", 1)))
+                ]
+            }
+        )
+
+    async def _cdn_image(self, request: web.Request) -> web.Response:
+        error = await self._simulate("cdn")
+        if error is not None:
+            return error
+        return web.Response(body=self._image, content_type="image/jpeg")
@@ -0,0 +1,321 @@
+"""
+Offline benchmark of the API against simulated upstreams.
+
+Starts FakeUpstreams, runs main.py under uvicorn with every upstream URL pointed at
+it and cold caches in a temporary directory, then sends each scenario's requests
+at a fixed concurrency. Reports p50/p95/p99 latency, throughput and the upstream
+calls made per scenario. No API credits are used.
+
+    python benchmark/run.py --requests 20 --concurrency 4
+    python benchmark/run.py --scenarios analyze pipeline --together-latency 0.3 --throttle-rate 0.05 --output before.json
+"""
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import aiohttp
+from fake_upstreams import FakeUpstreams
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COMPANY_NAME = "Benchmark Co"
+
+
+def percentile(values: list, q: float) -> float | None:
+    """Nearest-rank percentile of values (q in 0-100)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, round(q / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def _scenarios(competitor_ads: list) -> dict:
+    """Endpoint and payload builder per scenario; request i gets its own product."""
+    return {
+        "analyze": (
+            "/analyze-competitor-ads",
+            lambda i: {
+                "company_name": COMPANY_NAME,
+                "product_name": f"cold pressed oil {i}",
+            },
+        ),
+        "ideas": (
+            "/generate-ad-ideas",
+            lambda i: {
+                "competitor_ads": competitor_ads,
+                "product_name": f"herbal tea {i}",
+            },
+        ),
+        "pipeline": (
+            "/pipeline",
+            lambda i: {"company_name": COMPANY_NAME, "product_name": f"ghee {i}"},
+        ),
+        "marketing-text": (
+            "/generate-marketing-text",
+            lambda i: {
+                "idea": "Show the product at breakfast with a limited-time offer",
+                "company_name": COMPANY_NAME,
+                "product_name": f"peanut butter {i}",
+            },
+        ),
+        "image": (
+            "/generate-marketing-image",
+            lambda i: {
+                "prompt": f"A bottle of sesame oil on a kitchen table, variant {i}"
+            },
+        ),
+    }
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _server_env(upstreams_url: str, cache_dir: str) -> dict:
+    env = dict(os.environ)
+    env.update(
+        {
+            "TOGETHER_BASE_URL": f"{upstreams_url}/together/v1",
+            "META_ADS_API_URL": f"{upstreams_url}/rapidapi",
+            "RECRAFT_API_URL": f"{upstreams_url}/recraft/v1",
+            "TOGETHER_API_KEY": "benchmark",
+            "RAPIDAPI_KEY": "benchmark",
+            "RECRAFT_API_KEY": "benchmark",
+            "USE_SAMPLE_ADS": "false",
+            "LLM_CACHE_PATH": os.path.join(cache_dir, "llm_cache.sqlite3"),
+            "AD_CORPUS_PATH": os.path.join(cache_dir, "ad_corpus.sqlite3"),
+            "IMAGE_CACHE_DIR": os.path.join(cache_dir, "recraft"),
+            "THUMBNAIL_CACHE_DIR": os.path.join(cache_dir, "thumbnails"),
+            "TRACE_FILE": os.path.join(cache_dir, "traces.jsonl"),
+        }
+    )
+    return env
+
+
+async def _wait_until_ready(
+    session: aiohttp.ClientSession, api_url: str, timeout: float
+):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            async with session.get(f"{api_url}/upstream-limits") as res:
+                if res.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError(f"API did not start within {timeout}s")
+
+
+async def run_scenario(
+    session: aiohttp.ClientSession,
+    url: str,
+    build_payload,
+    requests: int,
+    concurrency: int,
+) -> dict:
+    """Sends `requests` POSTs with at most `concurrency` in flight; returns timings."""
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    latencies, errors = [], 0
+
+    async def send(i: int):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                async with session.post(url, json=build_payload(i)) as res:
+                    await res.read()
+                    ok = res.status < 400
+            except aiohttp.ClientError:
+                ok = False
+            latencies.append(time.perf_counter() - started)
+            errors += not ok
+
+    started = time.perf_counter()
+    await asyncio.gather(*(send(i) for i in range(requests)))
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": requests,
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(requests / elapsed, 3),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+    }
+
+
+def _upstream_summary(calls: dict) -> dict:
+    summary = {}
+    for (upstream, status), count in sorted(calls.items()):
+        summary.setdefault(upstream, {})[str(status)] = count
+    return summary
+
+
+def print_report(results: dict):
+    header = (
+        f"{'scenario':<16}{'req':>5}{'err':>5}{'rps':>9}"
+        f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}  upstream calls (by status)"
+    )
+    print(header)
+    print("-" * len(header))
+    for name, result in results.items():
+        calls = ", ".join(
+            upstream
+            + " "
+            + "/".join(f"{status}:{count}" for status, count in statuses.items())
+            for upstream, statuses in result["upstream_calls"].items()
+        )
+        print(
+            f"{name:<16}{result['requests']:>5}{result['errors']:>5}"
+            f"{result['throughput_rps']:>9.2f}{result['p50_ms']:>10.0f}"
+            f"{result['p95_ms']:>10.0f}{result['p99_ms']:>10.0f}  {calls}"
+        )
+
+
+async def main(args):
+    profiles = {}
+    for upstream in ("together", "rapidapi", "recraft"):
+        latency = getattr(args, f"{upstream}_latency")
+        if latency:
+            median, _, sigma = latency.partition(",")
+            profiles[upstream] = {"latency_median": float(median)}
+            if sigma:
+                profiles[upstream]["latency_sigma"] = float(sigma)
+        profiles.setdefault(upstream, {}).update(
+            {"error_rate": args.error_rate, "throttle_rate": args.throttle_rate}
+        )
+
+    upstreams = FakeUpstreams(
+        os.path.join(REPO_ROOT, "sample.json"),
+        profiles=profiles,
+        pages=args.pages,
+        relevant_rate=args.relevant_rate,
+        seed=args.seed,
+    )
+    upstreams_url = await upstreams.start()
+    port = args.port or _free_port()
+    api_url = f"http://127.0.0.1:{port}"
+
+    with tempfile.TemporaryDirectory(prefix="ad-benchmark-") as cache_dir:
+        log_path = os.path.join(cache_dir, "server.log")
+        with open(log_path, "w") as server_log:
+            server = subprocess.Popen(
+                [
+                    sys.executable,
+                    "-m",
+                    "uvicorn",
+                    "main:app",
+                    "--port",
+                    str(port),
+                    "--log-level",
+                    "warning",
+                ],
+                cwd=REPO_ROOT,
+                env=_server_env(upstreams_url, cache_dir),
+                stdout=server_log,
+                stderr=subprocess.STDOUT,
+            )
+            timeout = aiohttp.ClientTimeout(total=args.timeout)
+            connector = aiohttp.TCPConnector(limit=0)
+            results = {}
+            try:
+                async with aiohttp.ClientSession(
+                    timeout=timeout, connector=connector
+                ) as session:
+                    await _wait_until_ready(session, api_url, timeout=30)
+
+                    # Ads for the ideas scenario, from the fake ad library
+                    async with session.post(
+                        f"{api_url}/analyze-competitor-ads",
+                        json={"company_name": COMPANY_NAME, "product_name": "warm-up"},
+                    ) as res:
+                        res.raise_for_status()
+                        competitor_ads = (await res.json())["ads"]
+
+                    scenarios = _scenarios(competitor_ads)
+                    for name in args.scenarios:
+                        path, build_payload = scenarios[name]
+                        upstreams.reset_calls()
+                        result = await run_scenario(
+                            session,
+                            f"{api_url}{path}",
+                            build_payload,
+                            args.requests,
+                            args.concurrency,
+                        )
+                        result["upstream_calls"] = _upstream_summary(upstreams.calls)
+                        results[name] = result
+            finally:
+                server.terminate()
+                server.wait(timeout=10)
+                await upstreams.stop()
+                if server.returncode not in (0, -15):
+                    with open(log_path) as file:
+                        print(file.read()[-4000:])
+
+    print_report(results)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({"settings": vars(args), "results": results}, file, indent=2)
+        print(f"Results written to {args.output}")
+
+
+SCENARIOS = ["analyze", "ideas", "pipeline", "marketing-text", "image"]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the API against simulated upstreams"
+    )
+    parser.add_argument(
+        "--scenarios", nargs="+", default=SCENARIOS, choices=SCENARIOS
+    )
+    parser.add_argument(
+        "--requests", type=int, default=20, help="Requests per scenario"
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=4, help="Requests in flight at a time"
+    )
+    for upstream, label in [
+        ("together", "Together AI"),
+        ("rapidapi", "Meta Ad Library"),
+        ("recraft", "Recraft"),
+    ]:
+        parser.add_argument(
+            f"--{upstream}-latency", help=f"Median seconds[,sigma] of {label} calls"
+        )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.0,
+        help="Share of upstream calls failing with 500",
+    )
+    parser.add_argument(
+        "--throttle-rate",
+        type=float,
+        default=0.0,
+        help="Share of upstream calls answered with 429",
+    )
+    parser.add_argument(
+        "--relevant-rate", type=float, default=0.6, help="Share of ads judged relevant"
+    )
+    parser.add_argument(
+        "--pages", type=int, default=3, help="Ad Library pages per search"
+    )
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument(
+        "--port", type=int, default=0, help="API port (default: a free port)"
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=600, help="Per-request timeout in seconds"
+    )
+    parser.add_argument("--output", help="Write results as JSON, e.g. to compare runs")
+    asyncio.run(main(parser.parse_args()))
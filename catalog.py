@@ -0,0 +1,103 @@
+import os
+import asyncio
+from contextlib import aclosing
+from dotenv import load_dotenv
+from together_ai import analyze_product_name_async
+from ad_corpus import normalize_query
+from ad_analysis import (
+    iter_competitor_ads,
+    generate_ad_ideas_async,
+    MAX_ADS_TO_COLLECT,
+)
+load_dotenv(override=True)
+
+CATALOG_MAX_PRODUCTS = int(os.getenv("CATALOG_MAX_PRODUCTS", 500))
+CATALOG_LLM_CONCURRENCY = int(os.getenv("CATALOG_LLM_CONCURRENCY", 16))
+CATALOG_SEARCH_CONCURRENCY = int(os.getenv("CATALOG_SEARCH_CONCURRENCY", 4))
+
+
+async def iter_catalog(
+    company_name: str,
+    products: list,
+    countries: list | None = None,
+    generate_ideas: bool = False,
+    max_ads: int = MAX_ADS_TO_COLLECT,
+):
+    """
+    Analyzes competitor ads for every product of a catalog in one pipeline.
+
+    Each product generates its keyword and starts its competitor ad search on its
+    own, as soon as its keyword is ready. A product whose keyword is exactly equal,
+    after normalize_query, to one already searched reuses that search (running or
+    finished) instead of starting another. All LLM calls of the catalog (keywords, relevance checks and
+    ideas) draw from one budget of CATALOG_LLM_CONCURRENCY concurrent calls, and at
+    most CATALOG_SEARCH_CONCURRENCY searches run at a time.
+
+    Yields `(index, result)` as soon as a product is done, where index is the
+    product's position in products. A failing product yields an "error" result
+    without stopping the others.
+
+    Args:
+        company_name (str): Company whose own ads are excluded
+        products (list): Product names
+        countries (list, optional): Country codes to search, see iter_competitor_ads
+        generate_ideas (bool): Also generate ad ideas for each product's ads
+        max_ads (int): Relevant ads collected per search
+    """
+    llm_budget = asyncio.Semaphore(max(1, CATALOG_LLM_CONCURRENCY))
+    search_slots = asyncio.Semaphore(max(1, CATALOG_SEARCH_CONCURRENCY))
+    searches = {}
+
+    async def search(product_name: str, keyword: str) -> list:
+        async with search_slots:
+            relevant_ads = []
+            async with aclosing(
+                iter_competitor_ads(
+                    product_name,
+                    company_name,
+                    max_ads=max_ads,
+                    countries=countries,
+                    search_keyword=keyword,
+                    semaphore=llm_budget,
+                )
+            ) as ads:
+                async for position, ad in ads:
+                    relevant_ads.append((position, ad))
+        return [ad for _, ad in sorted(relevant_ads, key=lambda item: item[0])]
+
+    def shared_search(product_name: str, keyword: str) -> asyncio.Task:
+        key = normalize_query(keyword)
+        if key not in searches:
+            searches[key] = asyncio.create_task(search(product_name, keyword))
+        return searches[key]
+
+    async def analyze(index: int, product_name: str):
+        result = {"product_name": product_name}
+        try:
+            async with llm_budget:
+                keyword = await analyze_product_name_async(product_name, company_name)
+            result["keyword"] = keyword
+            # Shielded: the search may be shared with other products
+            result["ads"] = await asyncio.shield(shared_search(product_name, keyword))
+            if generate_ideas:
+                result["ad_ideas"] = await generate_ad_ideas_async(
+                    result["ads"], product_name, semaphore=llm_budget
+                )
+        except Exception as e:
+            print(f"Catalog analysis failed for {product_name}: {e}")
+            result["error"] = str(e)
+        return index, result
+
+    tasks = [
+        asyncio.create_task(analyze(index, product_name))
+        for index, product_name in enumerate(products)
+    ]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        pending = [*tasks, *searches.values()]
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        print(f"Catalog of {len(products)} products used {len(searches)} searches")
@@ -0,0 +1,163 @@
+import math
+import time
+import asyncio
+import contextvars
+from contextlib import contextmanager, asynccontextmanager
+
+# Absolute time.monotonic() by which the current request must be answered (or a
+# SharedDeadline). Async tasks and asyncio.to_thread copy it from the code that
+# started them, so every upstream call below an endpoint sees the endpoint's deadline.
+_deadline = contextvars.ContextVar("deadline", default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    """The request's time budget ran out before an upstream call could finish."""
+
+
+class SharedDeadline:
+    """
+    Deadline of work shared by several callers (see SingleFlight.do): the latest of
+    the callers' deadlines, or none once a caller without one joins.
+
+    The shared work runs under it, so it winds down (e.g. returns partial results)
+    by the deadline of the caller with the most time, and enforce() timeouts inside
+    it move out when a caller with more time joins. Callers with an earlier deadline
+    stop waiting at their own deadline through wait().
+    """
+
+    def __init__(self):
+        self.at = -math.inf
+        self._work_timeouts = set()
+        self._waiter_timeouts = {}
+
+    def join(self):
+        """Extends the shared deadline to the current caller's."""
+        own = _current()
+        if self.at is None or (own is not None and own <= self.at):
+            return
+        self.at = own
+        for timeout in self._work_timeouts:
+            _reschedule(timeout, self.at)
+        for timeout, waiter_own in self._waiter_timeouts.items():
+            _reschedule(timeout, self._waiter_deadline(waiter_own))
+
+    def _waiter_deadline(self, own: float) -> float | None:
+        # Only callers outlived by the shared work give up before it finishes
+        return own if self.at is None or own < self.at else None
+
+    async def wait(self, task: asyncio.Future):
+        """
+        Awaits the shared task for the current caller, up to the caller's own
+        deadline if the shared work runs longer than that.
+        """
+        own = _current()
+        if own is None:
+            return await asyncio.shield(task)
+        timeout = asyncio.timeout(None)
+        try:
+            async with timeout:
+                self._waiter_timeouts[timeout] = own
+                _reschedule(timeout, self._waiter_deadline(own))
+                return await asyncio.shield(task)
+        except TimeoutError:
+            if timeout.expired():
+                raise DeadlineExceeded(
+                    "Request deadline exceeded waiting for shared work"
+                ) from None
+            raise
+        finally:
+            self._waiter_timeouts.pop(timeout, None)
+
+
+def _current() -> float | None:
+    current = _deadline.get()
+    return current.at if isinstance(current, SharedDeadline) else current
+
+
+def _reschedule(timeout: asyncio.Timeout, at: float | None):
+    """Moves an entered asyncio.timeout to the monotonic time `at` (None: never)."""
+    if timeout.expired():
+        return
+    if at is not None:
+        at = asyncio.get_running_loop().time() + (at - time.monotonic())
+    timeout.reschedule(at)
+
+
+def share(shared: SharedDeadline):
+    """Makes `shared` the deadline of the current context, e.g. a copied one."""
+    _deadline.set(shared)
+
+
+@contextmanager
+def deadline_scope(seconds: float | None):
+    """
+    Runs the enclosed block with a budget of `seconds`, or the enclosing deadline if
+    that is sooner. None keeps the enclosing deadline (if any).
+    """
+    current = _current()
+    if seconds is not None:
+        candidate = time.monotonic() + max(0.0, seconds)
+        current = candidate if current is None else min(current, candidate)
+    token = _deadline.set(current)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> float | None:
+    """Seconds left until the current deadline, or None without one."""
+    current = _current()
+    return None if current is None else current - time.monotonic()
+
+
+def expired() -> bool:
+    budget = remaining()
+    return budget is not None and budget <= 0
+
+
+def check(what: str = "call"):
+    """Raises DeadlineExceeded if the current deadline has passed."""
+    if expired():
+        raise DeadlineExceeded(f"Request deadline exceeded before {what}")
+
+
+def capped(timeout: float, what: str = "call") -> float:
+    """
+    timeout, shortened to the time left until the current deadline.
+
+    Raises DeadlineExceeded rather than returning 0: requests rejects a zero
+    timeout and aiohttp treats total=0 as no timeout at all.
+    """
+    budget = remaining()
+    if budget is None:
+        return timeout
+    if budget <= 0:
+        raise DeadlineExceeded(f"Request deadline exceeded before {what}")
+    return min(timeout, budget)
+
+
+@asynccontextmanager
+async def enforce(what: str = "call"):
+    """Cancels the enclosed block when the current deadline passes, raising DeadlineExceeded."""
+    budget = remaining()
+    if budget is None:
+        yield
+        return
+    check(what)
+    shared = _deadline.get()
+    if not isinstance(shared, SharedDeadline):
+        shared = None
+    timeout = asyncio.timeout(budget)
+    try:
+        async with timeout:
+            if shared is not None:
+                shared._work_timeouts.add(timeout)
+            yield
+    except TimeoutError:
+        if timeout.expired():
+            raise DeadlineExceeded(f"Request deadline exceeded during {what}") from None
+        raise
+    finally:
+        if shared is not None:
+            shared._work_timeouts.discard(timeout)
@@ -1,10 +1,31 @@
 import requests
 import os
+import json
+import base64
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+import http_client
+from llm_cache import LLMCache
+from rate_limit import limiters
+from metrics import timed, cache_requests_total
+from tracing import traced, in_current_context
 
 
 load_dotenv()
 
+IMAGE_CACHE_ENABLED = os.getenv("IMAGE_CACHE_ENABLED", "true").lower() == "true"
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", ".cache/recraft")
+IMAGE_CACHE_TTL = float(os.getenv("IMAGE_CACHE_TTL", 24 * 3600))
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+IMAGE_BATCH_CONCURRENCY = int(os.getenv("IMAGE_BATCH_CONCURRENCY", 4))
+RECRAFT_API_URL = os.getenv("RECRAFT_API_URL", "https://external.api.recraft.ai/v1")
+
+# Metadata (URLs, names of stored image files) per (prompt, style, size, controls)
+image_cache = LLMCache(
+    path=os.path.join(IMAGE_CACHE_DIR, "index.sqlite3"), ttl=IMAGE_CACHE_TTL
+)
+
 
 def generate_image(
     prompt,
@@ -33,7 +54,7 @@ def generate_image(
         Response object containing generated image data
     """
     # API endpoint
-    url = "https://external.api.recraft.ai/v1/images/generations"
+    url = f"{RECRAFT_API_URL}/images/generations"
 
     # Headers
     headers = {
@@ -63,14 +84,132 @@ def generate_image(
 
     # Make API call
     try:
-        response = requests.post(url, headers=headers, json=request_body, timeout=15)
-        response.raise_for_status()  # Raise exception for error status codes
+        response = limiters["recraft"].call(
+            timed("recraft", "images/generations", _post_checked),
+            url,
+            headers,
+            request_body,
+        )
         return response.json()
     except requests.exceptions.RequestException as e:
         print(f"Error generating image: {str(e)}")
         return None
 
 
+def _image_cache_key(prompt, style, size, controls, response_format) -> str:
+    payload = json.dumps(
+        {
+            "prompt": prompt,
+            "style": style,
+            "size": size,
+            "controls": controls,
+            "response_format": response_format,
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _evict_image_files():
+    """Deletes the least recently written image files once the cache exceeds its size limit."""
+    files = []
+    for name in os.listdir(IMAGE_CACHE_DIR):
+        if name.endswith(".img"):
+            path = os.path.join(IMAGE_CACHE_DIR, name)
+            stat = os.stat(path)
+            files.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= IMAGE_CACHE_MAX_BYTES:
+            break
+        os.remove(path)
+        total -= size
+
+
+def _load_cached_images(entries: list) -> list | None:
+    """Turns cache entries back into Recraft "data" items, or None if a stored file is gone."""
+    images = []
+    for entry in entries:
+        if "file" in entry:
+            path = os.path.join(IMAGE_CACHE_DIR, entry["file"])
+            if not os.path.exists(path):
+                return None
+            with open(path, "rb") as file:
+                images.append({"b64_json": base64.b64encode(file.read()).decode()})
+        else:
+            images.append({"url": entry["url"]})
+    return images
+
+
+def _store_cached_images(cache_key: str, images: list):
+    entries = []
+    for index, image_data in enumerate(images):
+        if "b64_json" in image_data:
+            name = f"{cache_key}_{index}.img"
+            with open(os.path.join(IMAGE_CACHE_DIR, name), "wb") as file:
+                file.write(base64.b64decode(image_data["b64_json"]))
+            entries.append({"file": name})
+        elif "url" in image_data:
+            entries.append({"url": image_data["url"]})
+    image_cache.set(cache_key, entries)
+    _evict_image_files()
+
+
+@traced()
+def generate_images_cached(
+    prompt: str,
+    style: str,
+    n: int = 1,
+    size: str = "1024x1024",
+    controls: dict | None = None,
+    response_format: str = "url",
+) -> list:
+    """
+    Generates images through generate_image, re-using earlier results for identical requests.
+
+    Results are cached per (prompt, style, size, controls, response_format); an entry
+    holding two variants also serves a request for one. With response_format
+    'b64_json' the image bytes are kept on local disk (IMAGE_CACHE_DIR).
+
+    Returns:
+        list: Items of Recraft's "data" array (with "url" or "b64_json"), empty on failure
+    """
+    cache_key = _image_cache_key(prompt, style, size, controls, response_format)
+    if IMAGE_CACHE_ENABLED:
+        entries = image_cache.get(cache_key)
+        if entries and len(entries) >= n:
+            images = _load_cached_images(entries[:n])
+            if images is not None:
+                cache_requests_total.inc(cache="image", result="hit")
+                return images
+        cache_requests_total.inc(cache="image", result="miss")
+
+    response = generate_image(
+        prompt=prompt,
+        style=style,
+        size=size,
+        controls=controls,
+        n=n,
+        response_format=response_format,
+    )
+    if not response or "data" not in response:
+        return []
+
+    images = response["data"]
+    if IMAGE_CACHE_ENABLED and images:
+        os.makedirs(IMAGE_CACHE_DIR, exist_ok=True)
+        _store_cached_images(cache_key, images)
+    return images
+
+
+def _post_checked(url: str, headers: dict, request_body: dict):
+    response = http_client.post(
+        url, headers=headers, json=request_body, timeout=(5, 15)
+    )
+    response.raise_for_status()  # Raise exception for error status codes
+    return response
+
+
 def generate_marketing_ad_image(
     prompt: str, style: str = "digital_illustration"
 ) -> str:
@@ -84,6 +223,19 @@ def generate_marketing_ad_image(
     Returns:
         str: URL of the generated image, or None if generation failed
     """
+    urls = generate_marketing_ad_image_variants(prompt, style, variants=1)
+    return urls[0] if urls else None
+
+
+def generate_marketing_ad_image_variants(
+    prompt: str, style: str = "digital_illustration", variants: int = 2
+) -> list:
+    """
+    Generates up to two variants of a marketing ad image in a single Recraft request.
+
+    Returns:
+        list: URLs of the generated images, empty if generation failed
+    """
     size = "1024x1024"  # High resolution square image
 
     # Default controls for high quality marketing ads
@@ -92,17 +244,45 @@ def generate_marketing_ad_image(
         "composition": "centered",
         "style_strength": "high",
     }
-    response = generate_image(
+    images = generate_images_cached(
         prompt=prompt,
         style=style,
         size=size,
         controls=controls,
-        n=1,  # Generate single image
+        n=max(1, min(variants, 2)),  # Recraft accepts 1 or 2
     )
+    return [image_data["url"] for image_data in images if "url" in image_data]
+
 
-    if response and "data" in response:
-        image_data = response["data"][0]
-        if "url" in image_data:
-            return image_data["url"]
+def generate_marketing_ad_images(
+    prompts: list,
+    style: str = "digital_illustration",
+    variants: int = 1,
+    max_workers: int = IMAGE_BATCH_CONCURRENCY,
+) -> list:
+    """
+    Generates marketing ad images for several prompts concurrently.
+
+    Args:
+        prompts (list): Descriptions of the marketing ads to generate
+        style (str, optional): Style of the generated images
+        variants (int, optional): Images per prompt (1 or 2)
+        max_workers (int, optional): Maximum number of concurrent Recraft requests
 
-    return None
+    Returns:
+        list: One list of image URLs per prompt, in input order (empty on failure)
+    """
+    if not prompts:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        return list(
+            executor.map(
+                # Pool threads don't inherit the caller's span on their own
+                in_current_context(
+                    lambda prompt: generate_marketing_ad_image_variants(
+                        prompt, style, variants
+                    )
+                ),
+                prompts,
+            )
+        )
@@ -0,0 +1,153 @@
+import os
+import asyncio
+import threading
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+import deadline
+load_dotenv(override=True)
+
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", 5))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", 60))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", 100))
+HTTP_MAX_CONNECTIONS_PER_HOST = int(os.getenv("HTTP_MAX_CONNECTIONS_PER_HOST", 20))
+HTTP_POOLED_HOSTS = int(os.getenv("HTTP_POOLED_HOSTS", 10))
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", 30))
+
+_session: requests.Session | None = None
+_session_lock = threading.Lock()
+
+# Shared keep-alive session for async calls, bound to the loop that created it
+_async_session: aiohttp.ClientSession | None = None
+_async_session_loop: asyncio.AbstractEventLoop | None = None
+_async_stats = {"connections_created": 0, "connections_reused": 0}
+
+
+def get_session() -> requests.Session:
+    """
+    Returns the process-wide pooled requests session.
+
+    Connections are kept alive and pooled per host (HTTP_MAX_CONNECTIONS_PER_HOST
+    for up to HTTP_POOLED_HOSTS hosts), so repeated calls to RapidAPI and Recraft
+    skip the TCP and TLS handshakes.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=HTTP_POOLED_HOSTS,
+                    pool_maxsize=HTTP_MAX_CONNECTIONS_PER_HOST,
+                )
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+
+def request(method: str, url: str, timeout=None, **kwargs) -> requests.Response:
+    """
+    Sends a request through the pooled session.
+
+    Args:
+        timeout (float | tuple, optional): Overrides the default
+            (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+    """
+    if timeout is None:
+        timeout = (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+    # Give up when the request deadline passes rather than after the full timeout
+    what = f"{method} {url}"
+    if isinstance(timeout, tuple):
+        timeout = tuple(deadline.capped(value, what) for value in timeout)
+    else:
+        timeout = deadline.capped(timeout, what)
+    try:
+        return get_session().request(method, url, timeout=timeout, **kwargs)
+    except requests.exceptions.Timeout as e:
+        # A timeout shortened by the deadline is the deadline running out
+        if deadline.expired():
+            raise deadline.DeadlineExceeded(
+                f"Request deadline exceeded during {what}"
+            ) from e
+        raise
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    return request("GET", url, **kwargs)
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    return request("POST", url, **kwargs)
+
+
+async def _on_connection_create_end(session, context, params):
+    _async_stats["connections_created"] += 1
+
+
+async def _on_connection_reuseconn(session, context, params):
+    _async_stats["connections_reused"] += 1
+
+
+async def get_async_session() -> aiohttp.ClientSession:
+    """
+    Returns the pooled keep-alive aiohttp session used for async upstream calls.
+
+    The session is created lazily and recreated if the running event loop changed
+    (e.g. between asyncio.run calls from the sync wrappers).
+    """
+    global _async_session, _async_session_loop
+    loop = asyncio.get_running_loop()
+    if (
+        _async_session is None
+        or _async_session.closed
+        or _async_session_loop is not loop
+    ):
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_create_end.append(_on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(_on_connection_reuseconn)
+        connector = aiohttp.TCPConnector(
+            limit=HTTP_MAX_CONNECTIONS,
+            limit_per_host=HTTP_MAX_CONNECTIONS_PER_HOST,
+            keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+        )
+        _async_session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(
+                connect=HTTP_CONNECT_TIMEOUT, sock_read=HTTP_READ_TIMEOUT
+            ),
+            trace_configs=[trace_config],
+        )
+        _async_session_loop = loop
+    return _async_session
+
+
+async def close_async_session():
+    """Closes the pooled async session, e.g. on application shutdown."""
+    global _async_session, _async_session_loop
+    if _async_session is not None and not _async_session.closed:
+        await _async_session.close()
+    _async_session = None
+    _async_session_loop = None
+
+
+def connection_stats() -> dict:
+    """Connections opened vs. reused by the sync and async pools of this process."""
+    created, requests_sent = 0, 0
+    if _session is not None:
+        for adapter in set(_session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                created += pool.num_connections
+                requests_sent += pool.num_requests
+    return {
+        "sync": {
+            "connections_created": created,
+            "connections_reused": max(0, requests_sent - created),
+        },
+        "async": dict(_async_stats),
+    }
@@ -0,0 +1,206 @@
+import os
+import time
+import uuid
+import asyncio
+from contextlib import aclosing
+from dotenv import load_dotenv
+load_dotenv(override=True)
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 4))
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", 100))
+JOB_RETENTION = float(os.getenv("JOB_RETENTION", 3600))
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class Job:
+    """A queued unit of pipeline work whose partial results can be polled or streamed."""
+
+    def __init__(self, kind: str, stream_factory, total: int | None, collect):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.status = "queued"
+        self.total = total
+        self.partial_results = []
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self._stream_factory = stream_factory
+        self._collect = collect
+        self._task = None
+        self._changed = asyncio.Condition()
+
+    @property
+    def done(self) -> bool:
+        return self.status in ("succeeded", "failed", "cancelled")
+
+    @property
+    def progress(self) -> float | None:
+        if self.status == "succeeded":
+            return 1.0
+        if not self.total:
+            return None
+        return min(1.0, len(self.partial_results) / self.total)
+
+    async def _notify(self):
+        async with self._changed:
+            self._changed.notify_all()
+
+    async def wait_for_change(self, seen_results: int, timeout: float = 15):
+        """Waits until there are more than seen_results partial results or the job finished."""
+        async with self._changed:
+            try:
+                await asyncio.wait_for(
+                    self._changed.wait_for(
+                        lambda: self.done or len(self.partial_results) > seen_results
+                    ),
+                    timeout,
+                )
+            except asyncio.TimeoutError:
+                pass
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "progress": self.progress,
+            "partial_results": self.partial_results,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobManager:
+    """
+    Bounded job queue drained by a fixed pool of asyncio workers.
+
+    A job wraps an async generator factory: every item it yields is appended to the
+    job's partial results and the final result is `collect(partial_results)`.
+    Finished jobs are kept for `retention` seconds.
+    """
+
+    def __init__(
+        self,
+        workers: int = JOB_WORKERS,
+        queue_size: int = JOB_QUEUE_SIZE,
+        retention: float = JOB_RETENTION,
+    ):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.retention = retention
+        self.jobs = {}
+        self._queue = None
+        self._worker_tasks = []
+        # The loop only keeps weak references to tasks; these must not be collected
+        self._notify_tasks = set()
+
+    def start(self):
+        """Starts the worker pool on the running event loop."""
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._worker_tasks = [
+            asyncio.create_task(self._worker()) for _ in range(max(1, self.workers))
+        ]
+
+    async def stop(self):
+        for job in self.jobs.values():
+            if not job.done:
+                self.cancel(job.id)
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+
+    def submit(
+        self, kind: str, stream_factory, total: int | None = None, collect=list
+    ) -> Job:
+        """
+        Queues a job, raising JobQueueFull when the queue is at capacity.
+
+        Args:
+            kind (str): Job type reported back to clients
+            stream_factory (callable): Returns the async generator doing the work
+            total (int, optional): Expected number of items, used for progress
+            collect (callable): Builds the final result from the partial results
+        """
+        self._expire()
+        job = Job(kind, stream_factory, total, collect)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise JobQueueFull(f"Job queue is full ({self.queue_size} jobs)")
+        self.jobs[job.id] = job
+        return job
+
+    def get(self, job_id: str) -> Job | None:
+        self._expire()
+        return self.jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> Job | None:
+        job = self.jobs.get(job_id)
+        if job is None or job.done:
+            return job
+        if job._task is not None:
+            job._task.cancel()
+        else:
+            # Still queued, the worker skips it
+            self._finish(job, "cancelled")
+        return job
+
+    def _finish(self, job: Job, status: str, error: str | None = None):
+        job.status = status
+        job.error = error
+        job.finished_at = time.time()
+        task = asyncio.get_running_loop().create_task(job._notify())
+        self._notify_tasks.add(task)
+        task.add_done_callback(self._notify_tasks.discard)
+
+    def _expire(self):
+        cutoff = time.time() - self.retention
+        expired = [
+            job_id
+            for job_id, job in self.jobs.items()
+            if job.done and job.finished_at < cutoff
+        ]
+        for job_id in expired:
+            del self.jobs[job_id]
+
+    async def _run(self, job: Job):
+        async with aclosing(job._stream_factory()) as items:
+            async for item in items:
+                job.partial_results.append(item)
+                await job._notify()
+        job.result = job._collect(job.partial_results)
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                if job.done:
+                    continue
+                job.status = "running"
+                await job._notify()
+                job._task = asyncio.create_task(self._run(job))
+                try:
+                    await job._task
+                    self._finish(job, "succeeded")
+                except asyncio.CancelledError:
+                    if not job._task.cancelled():
+                        # The worker itself is being stopped
+                        job._task.cancel()
+                        self._finish(job, "cancelled")
+                        raise
+                    self._finish(job, "cancelled")
+                except Exception as e:
+                    print(f"Job {job.id} ({job.kind}) failed: {e}")
+                    self._finish(job, "failed", str(e))
+            finally:
+                self._queue.task_done()
+
+
+job_manager = JobManager()
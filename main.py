@@ -1,23 +1,175 @@
 import os
+import json
+import time
 import asyncio
-from fastapi import FastAPI, HTTPException
+from contextlib import asynccontextmanager, aclosing
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from pydantic import BaseModel
-from together_ai import analyze_product_name, generate_text_for_marketing_post
+from together_ai import (
+    analyze_product_name,
+    cascade_stats,
+    generate_text_for_marketing_post_async,
+    llm_flight,
+)
+from http_client import close_async_session
 from meta_ad_library import search_meta_ads
 from dotenv import load_dotenv
-from ad_analysis import fetch_and_analyze_competitor_ads, generate_ad_ideas
-from generate_image import generate_marketing_ad_image
+from ad_analysis import (
+    fetch_and_analyze_competitor_ads_async,
+    generate_ad_ideas_async,
+    iter_competitor_ads,
+    iter_ad_ideas,
+    iter_pipeline,
+    MAX_ADS_TO_COLLECT,
+)
+from generate_image import generate_marketing_ad_image, generate_marketing_ad_images
+from jobs import job_manager, JobQueueFull
+from catalog import iter_catalog, CATALOG_MAX_PRODUCTS
+from rate_limit import upstream_limits
+from ad_text import preprocessing_stats
+from single_flight import SingleFlight
+from ad_images import thumbnail_flight
+from metrics import CallbackMetric, http_request_seconds, render
+from tracing import start_span, end_span_scope
+import deadline
+from deadline import DeadlineExceeded, deadline_scope
 load_dotenv(override=True)
-app = FastAPI()
+
+REQUEST_BUDGET = float(os.getenv("REQUEST_BUDGET", 120))
+# Seconds per route, other routes use REQUEST_BUDGET. None runs without a deadline
+# unless the client sends one in X-Request-Timeout.
+ROUTE_BUDGETS = {
+    "/generate-marketing-image": float(os.getenv("IMAGE_REQUEST_BUDGET", 15)),
+    "/generate-marketing-text": float(os.getenv("TEXT_REQUEST_BUDGET", 30)),
+    "/catalog/stream": None,
+}
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    job_manager.start()
+    yield
+    await job_manager.stop()
+    # Release pooled keep-alive upstream connections
+    await close_async_session()
+
+
+app = FastAPI(lifespan=lifespan)
+
+# Identical requests in flight at the same time share one pipeline run
+request_flight = SingleFlight("endpoints")
+
+
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    started = time.perf_counter()
+    status = 500
+    # Root span of the request; every span of the pipeline below becomes its child
+    request_span, token = start_span(f"{request.method} {request.url.path}")
+    try:
+        # Every upstream call made for the request inherits its deadline
+        with deadline_scope(_request_budget(request)):
+            response = await call_next(request)
+        status = response.status_code
+    except BaseException as e:
+        if request_span:
+            request_span.end(e)
+        raise
+    finally:
+        end_span_scope(token)
+        route = request.scope.get("route")
+        http_request_seconds.observe(
+            time.perf_counter() - started,
+            method=request.method,
+            route=route.path if route else "unmatched",
+            status=status,
+        )
+    if request_span:
+        request_span.set(status=status)
+        response.headers["X-Trace-Id"] = request_span.trace_id
+        response.body_iterator = _end_span_after_body(
+            response.body_iterator, request_span
+        )
+    return response
+
+
+def _request_budget(request: Request) -> float | None:
+    """Route budget, shortened to the client's own X-Request-Timeout (seconds)."""
+    budget = ROUTE_BUDGETS.get(request.url.path, REQUEST_BUDGET)
+    try:
+        client_budget = float(request.headers.get("X-Request-Timeout", ""))
+    except ValueError:
+        return budget
+    return client_budget if budget is None else min(budget, client_budget)
+
+
+async def _end_span_after_body(body_iterator, request_span):
+    # Streaming endpoints keep working after the headers are sent
+    try:
+        async for chunk in body_iterator:
+            yield chunk
+    finally:
+        request_span.end()
+
+
+# State that the modules already count, read when /metrics is scraped
+CallbackMetric(
+    "upstream_concurrency_window",
+    "Current AIMD concurrency window per upstream",
+    "gauge",
+    lambda: [
+        ({"upstream": name}, limits["concurrency_window"])
+        for name, limits in upstream_limits().items()
+    ],
+)
+CallbackMetric(
+    "upstream_in_flight",
+    "Upstream requests currently in flight",
+    "gauge",
+    lambda: [
+        ({"upstream": name}, limits["in_flight"])
+        for name, limits in upstream_limits().items()
+    ],
+)
+CallbackMetric(
+    "single_flight_coalesced_total",
+    "Calls that joined an identical call already in flight",
+    "counter",
+    lambda: [
+        ({"flight": flight.name}, flight.stats()["coalesced"])
+        for flight in (request_flight, llm_flight, thumbnail_flight)
+    ],
+)
+CallbackMetric(
+    "model_cascade_answers_total",
+    "Answers decided or escalated per model of the cascade",
+    "counter",
+    lambda: [
+        ({"model": tier["model"], "decision": decision}, tier[decision])
+        for tier in cascade_stats()
+        for decision in ("decided", "escalated")
+    ],
+)
+CallbackMetric(
+    "ad_copy_tokens_saved_total",
+    "Estimated prompt tokens saved by ad copy preprocessing",
+    "counter",
+    lambda: [({}, preprocessing_stats()["tokens_saved"])],
+)
 
 
 class CompetitorAdRequest(BaseModel):
     product_name: str
     company_name: str
+    # Markets and extra keyword variants searched concurrently, results merged
+    countries: list[str] | None = None
+    keywords: list[str] | None = None
 
 
 class CompetitorAdResponse(BaseModel):
     ads: list
+    partial: bool = False  # The request deadline cut the search short
 
 
 class AdIdeaRequest(BaseModel):
@@ -27,6 +179,7 @@ class AdIdeaRequest(BaseModel):
 
 class AdIdeaResponse(BaseModel):
     ad_ideas: list
+    partial: bool = False  # Ideas missing when the request deadline passed are None
 
 
 # Example curl command:
@@ -34,16 +187,33 @@ class AdIdeaResponse(BaseModel):
 curl -X POST http://localhost:8000/analyze-competitor-ads \
   -H "Content-Type: application/json" \
   -d '{"product_name": "smartphone", "company_name": "TechCo"}'
+
+Several markets and keyword variants in one call:
+curl -X POST http://localhost:8000/analyze-competitor-ads \
+  -H "Content-Type: application/json" \
+  -d '{"product_name": "smartphone", "company_name": "TechCo", "countries": ["IN", "US", "GB"], "keywords": ["android phone"]}'
 """
 
 
 @app.post("/analyze-competitor-ads")
 async def analyze_competitor_ads(request: CompetitorAdRequest):
+    async def analyze() -> CompetitorAdResponse:
+        status = {}
+        ads_data = await fetch_and_analyze_competitor_ads_async(
+            request.product_name,
+            request.company_name,
+            request.countries,
+            request.keywords,
+            status=status,
+        )
+        return CompetitorAdResponse(ads=ads_data, partial=status.get("partial", False))
+
     try:
-        ads_data = fetch_and_analyze_competitor_ads(
-            request.product_name, request.company_name
+        return await request_flight.do(
+            ("analyze-competitor-ads", request.model_dump_json()), analyze
         )
-        return CompetitorAdResponse(ads=ads_data)
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -58,13 +228,176 @@ curl -X POST http://localhost:8000/generate-ad-ideas \
 
 @app.post("/generate-ad-ideas")
 async def generate_ideas(request: AdIdeaRequest):
+    async def ideate() -> AdIdeaResponse:
+        status = {}
+        ad_ideas = await generate_ad_ideas_async(
+            request.competitor_ads, request.product_name, status=status
+        )
+        return AdIdeaResponse(ad_ideas=ad_ideas, partial=status.get("partial", False))
+
     try:
-        ad_ideas = generate_ad_ideas(request.competitor_ads, request.product_name)
-        return AdIdeaResponse(ad_ideas=ad_ideas)
+        return await request_flight.do(
+            ("generate-ad-ideas", request.model_dump_json()), ideate
+        )
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def ndjson_event(event: str, **fields) -> str:
+    """One line of a newline-delimited JSON stream."""
+    return json.dumps({"event": event, **fields}) + "\n"
+
+
+# Example curl command (one JSON event per line: "ad"..., then "summary" or "error"):
+"""
+curl -N -X POST http://localhost:8000/analyze-competitor-ads/stream \
+  -H "Content-Type: application/json" \
+  -d '{"product_name": "smartphone", "company_name": "TechCo"}'
+"""
+
+
+@app.post("/analyze-competitor-ads/stream")
+async def analyze_competitor_ads_stream(request: CompetitorAdRequest):
+    async def events():
+        started = time.monotonic()
+        count = 0
+        status = {}
+        try:
+            async with aclosing(
+                iter_competitor_ads(
+                    request.product_name,
+                    request.company_name,
+                    countries=request.countries,
+                    keywords=request.keywords,
+                    status=status,
+                )
+            ) as ads:
+                async for _, ad in ads:
+                    count += 1
+                    yield ndjson_event("ad", ad=ad)
+            yield ndjson_event(
+                "summary",
+                count=count,
+                elapsed=round(time.monotonic() - started, 2),
+                partial=status.get("partial", False),
+            )
+        except Exception as e:
+            yield ndjson_event("error", detail=str(e))
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+
+# Example curl command (one JSON event per line: "idea"..., then "summary" or "error"):
+"""
+curl -N -X POST http://localhost:8000/generate-ad-ideas/stream \
+  -H "Content-Type: application/json" \
+  -d '{"competitor_ads": [{"text": "ad text", "image_url": "http://example.com/image.jpg"}], "product_name": "smartphone"}'
+"""
+
+
+@app.post("/generate-ad-ideas/stream")
+async def generate_ideas_stream(request: AdIdeaRequest):
+    async def events():
+        started = time.monotonic()
+        count = 0
+        status = {}
+        try:
+            async with aclosing(
+                iter_ad_ideas(
+                    request.competitor_ads, request.product_name, status=status
+                )
+            ) as ideas:
+                async for index, idea in ideas:
+                    count += 1
+                    yield ndjson_event("idea", index=index, idea=idea)
+            yield ndjson_event(
+                "summary",
+                count=count,
+                elapsed=round(time.monotonic() - started, 2),
+                partial=status.get("partial", False),
+            )
+        except Exception as e:
+            yield ndjson_event("error", detail=str(e))
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+
+class PipelineResponse(BaseModel):
+    ads: list
+    ad_ideas: list
+    partial: bool = False
+
+
+def _iter_pipeline(request: CompetitorAdRequest, status: dict):
+    return iter_pipeline(
+        request.product_name,
+        request.company_name,
+        countries=request.countries,
+        keywords=request.keywords,
+        status=status,
+    )
+
+
+# Example curl commands (competitor ads and their ad ideas in one call; the stream
+# yields "ad" and "idea" events as they are ready, then "summary" or "error"):
+"""
+curl -X POST http://localhost:8000/pipeline \
+  -H "Content-Type: application/json" \
+  -d '{"product_name": "smartphone", "company_name": "TechCo"}'
+curl -N -X POST http://localhost:8000/pipeline/stream \
+  -H "Content-Type: application/json" \
+  -d '{"product_name": "smartphone", "company_name": "TechCo"}'
+"""
+
+
+@app.post("/pipeline")
+async def run_pipeline(request: CompetitorAdRequest):
+    async def collect() -> PipelineResponse:
+        ads, ideas, status = {}, {}, {}
+        async with aclosing(_iter_pipeline(request, status)) as events:
+            async for event, position, item in events:
+                (ads if event == "ad" else ideas)[position] = item
+        positions = sorted(ads)
+        return PipelineResponse(
+            ads=[ads[position] for position in positions],
+            ad_ideas=[ideas.get(position) for position in positions],
+            partial=status.get("partial", False),
+        )
+
+    try:
+        return await request_flight.do(("pipeline", request.model_dump_json()), collect)
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/pipeline/stream")
+async def run_pipeline_stream(request: CompetitorAdRequest):
+    async def events():
+        started = time.monotonic()
+        counts = {"ad": 0, "idea": 0}
+        status = {}
+        try:
+            async with aclosing(_iter_pipeline(request, status)) as pipeline:
+                async for event, position, item in pipeline:
+                    counts[event] += 1
+                    yield ndjson_event(event, position=list(position), **{event: item})
+            yield ndjson_event(
+                "summary",
+                ads=counts["ad"],
+                ideas=counts["idea"],
+                elapsed=round(time.monotonic() - started, 2),
+                partial=status.get("partial", False),
+            )
+        except Exception as e:
+            yield ndjson_event("error", detail=str(e))
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+
 class ImageGenerationRequest(BaseModel):
     prompt: str
     style: str = "digital_illustration"
@@ -85,14 +418,49 @@ curl -X POST http://localhost:8000/generate-marketing-image \
 @app.post("/generate-marketing-image")
 async def generate_marketing_image(request: ImageGenerationRequest):
     try:
-        # Generate image with 15 second timeout
-        async with asyncio.timeout(15):
+        # Bounded by the request deadline (IMAGE_REQUEST_BUDGET)
+        async with asyncio.timeout(deadline.remaining()):
             image_url = await asyncio.to_thread(
                 generate_marketing_ad_image, request.prompt, request.style
             )
             if not image_url:
                 raise HTTPException(status_code=500, detail="Failed to generate image")
             return ImageGenerationResponse(image_url=image_url)
+    except TimeoutError as e:
+        detail = str(e) or "Image generation timed out"
+        raise HTTPException(status_code=504, detail=detail)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+class ImageBatchRequest(BaseModel):
+    prompts: list[str]
+    style: str = "digital_illustration"
+    variants: int = 1  # 1 or 2 images per prompt
+
+
+class ImageBatchResponse(BaseModel):
+    images: list[list[str]]
+
+
+# Example curl command:
+"""
+curl -X POST http://localhost:8000/generate-marketing-images \
+  -H "Content-Type: application/json" \
+  -d '{"prompts": ["A modern smartphone with sleek design", "A smartphone on a beach"], "variants": 2}'
+"""
+
+
+@app.post("/generate-marketing-images")
+async def generate_marketing_images(request: ImageBatchRequest):
+    try:
+        images = await asyncio.to_thread(
+            generate_marketing_ad_images,
+            request.prompts,
+            request.style,
+            request.variants,
+        )
+        return ImageBatchResponse(images=images)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -119,12 +487,230 @@ curl -X POST http://localhost:8000/generate-marketing-text \
 @app.post("/generate-marketing-text")
 async def generate_marketing_text(request: MarketingTextRequest):
     try:
-        marketing_text = generate_text_for_marketing_post(
-            idea=request.idea,
-            company_name=request.company_name,
-            product_name=request.product_name,
-            user_input=request.user_input,
+        marketing_text = await request_flight.do(
+            ("generate-marketing-text", request.model_dump_json()),
+            lambda: generate_text_for_marketing_post_async(
+                idea=request.idea,
+                company_name=request.company_name,
+                product_name=request.product_name,
+                user_input=request.user_input,
+            ),
         )
         return MarketingTextResponse(marketing_text=marketing_text)
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+
+class JobResponse(BaseModel):
+    job_id: str
+    kind: str
+    status: str
+    progress: float | None = None
+    partial_results: list = []
+    result: list | None = None
+    error: str | None = None
+    created_at: float
+    finished_at: float | None = None
+
+
+async def _ads_job_stream(request: CompetitorAdRequest):
+    async with aclosing(
+        iter_competitor_ads(
+            request.product_name,
+            request.company_name,
+            countries=request.countries,
+            keywords=request.keywords,
+        )
+    ) as ads:
+        async for position, ad in ads:
+            yield {"position": list(position), "ad": ad}
+
+
+async def _ideas_job_stream(competitor_ads: list, product_name: str):
+    async with aclosing(iter_ad_ideas(competitor_ads, product_name)) as ideas:
+        async for index, idea in ideas:
+            yield {"index": index, "idea": idea}
+
+
+def _submit_job(kind: str, stream_factory, total: int | None, collect) -> JobResponse:
+    try:
+        job = job_manager.submit(kind, stream_factory, total=total, collect=collect)
+    except JobQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return JobResponse(**job.to_dict())
+
+
+def _get_job_or_404(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job
+
+
+# Example curl commands (submit, then poll, stream or cancel with the returned job_id):
+"""
+curl -X POST http://localhost:8000/jobs/generate-ad-ideas \
+  -H "Content-Type: application/json" \
+  -d '{"competitor_ads": [{"text": "ad text", "image_url": "http://example.com/image.jpg"}], "product_name": "smartphone"}'
+curl http://localhost:8000/jobs/<job_id>
+curl -N http://localhost:8000/jobs/<job_id>/stream
+curl -X DELETE http://localhost:8000/jobs/<job_id>
+"""
+
+
+@app.post("/jobs/generate-ad-ideas", status_code=202)
+async def submit_generate_ideas_job(request: AdIdeaRequest) -> JobResponse:
+    return _submit_job(
+        "generate-ad-ideas",
+        lambda: _ideas_job_stream(request.competitor_ads, request.product_name),
+        total=len(request.competitor_ads),
+        collect=lambda items: [
+            item["idea"] for item in sorted(items, key=lambda item: item["index"])
+        ],
+    )
+
+
+@app.post("/jobs/analyze-competitor-ads", status_code=202)
+async def submit_analyze_competitor_ads_job(
+    request: CompetitorAdRequest,
+) -> JobResponse:
+    return _submit_job(
+        "analyze-competitor-ads",
+        lambda: _ads_job_stream(request),
+        total=MAX_ADS_TO_COLLECT,
+        collect=lambda items: [
+            item["ad"] for item in sorted(items, key=lambda item: item["position"])
+        ],
+    )
+
+
+class CatalogRequest(BaseModel):
+    company_name: str
+    products: list[str]
+    countries: list[str] | None = None
+    generate_ideas: bool = False
+
+
+def _check_catalog_size(request: CatalogRequest):
+    if len(request.products) > CATALOG_MAX_PRODUCTS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {CATALOG_MAX_PRODUCTS} products per catalog request",
+        )
+
+
+async def _catalog_job_stream(request: CatalogRequest):
+    async with aclosing(
+        iter_catalog(
+            request.company_name,
+            request.products,
+            countries=request.countries,
+            generate_ideas=request.generate_ideas,
+        )
+    ) as results:
+        async for index, result in results:
+            yield {"index": index, **result}
+
+
+# Example curl commands (the stream yields one "product" event per product as soon
+# as it is done, then "summary"; the job collects them in catalog order):
+"""
+curl -N -X POST http://localhost:8000/catalog/stream \
+  -H "Content-Type: application/json" \
+  -d '{"company_name": "TechCo", "products": ["smartphone", "wireless earbuds", "phone case"], "generate_ideas": false}'
+curl -X POST http://localhost:8000/jobs/catalog \
+  -H "Content-Type: application/json" \
+  -d '{"company_name": "TechCo", "products": ["smartphone", "wireless earbuds", "phone case"]}'
+"""
+
+
+@app.post("/catalog/stream")
+async def analyze_catalog_stream(request: CatalogRequest):
+    _check_catalog_size(request)
+
+    async def events():
+        started = time.monotonic()
+        count, failed = 0, 0
+        try:
+            async with aclosing(_catalog_job_stream(request)) as results:
+                async for result in results:
+                    count += 1
+                    failed += "error" in result
+                    yield ndjson_event("product", **result)
+            yield ndjson_event(
+                "summary",
+                count=count,
+                failed=failed,
+                elapsed=round(time.monotonic() - started, 2),
+            )
+        except Exception as e:
+            yield ndjson_event("error", detail=str(e))
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+
+@app.post("/jobs/catalog", status_code=202)
+async def submit_catalog_job(request: CatalogRequest) -> JobResponse:
+    _check_catalog_size(request)
+    return _submit_job(
+        "catalog",
+        lambda: _catalog_job_stream(request),
+        total=len(request.products),
+        collect=lambda items: sorted(items, key=lambda item: item["index"]),
+    )
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str) -> JobResponse:
+    return JobResponse(**_get_job_or_404(job_id).to_dict())
+
+
+@app.get("/jobs/{job_id}/stream")
+async def stream_job(job_id: str):
+    job = _get_job_or_404(job_id)
+
+    async def events():
+        sent = 0
+        while True:
+            await job.wait_for_change(sent)
+            while sent < len(job.partial_results):
+                yield ndjson_event("partial_result", item=job.partial_results[sent])
+                sent += 1
+            if job.done and sent >= len(job.partial_results):
+                yield ndjson_event("job", **JobResponse(**job.to_dict()).model_dump())
+                return
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str) -> JobResponse:
+    _get_job_or_404(job_id)
+    return JobResponse(**job_manager.cancel(job_id).to_dict())
+
+
+# Current per-provider rate limits, concurrency windows and throttling counters
+@app.get("/upstream-limits")
+async def get_upstream_limits():
+    return upstream_limits()
+
+
+# Estimated prompt tokens saved by cleaning and truncating ad copy
+@app.get("/ad-copy-stats")
+async def get_ad_copy_stats():
+    return preprocessing_stats()
+
+
+# Share of answers each model of the relevance/keyword cascade decided itself
+@app.get("/model-cascade-stats")
+async def get_model_cascade_stats():
+    return cascade_stats()
+
+
+# Prometheus scrape target: upstream latency, tokens, cost, errors, retries and cache
+# hit/miss counts
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    return PlainTextResponse(render(), media_type="text/plain; version=0.0.4")
@@ -1,20 +1,129 @@
-import requests
 import os
+import asyncio
 from dotenv import load_dotenv 
+import http_client
+from rate_limit import limiters
+from metrics import timed, log_sampled
+from tracing import span
 load_dotenv(override=True)
 
+META_ADS_READ_AHEAD = int(os.getenv("META_ADS_READ_AHEAD", 1))
+META_ADS_MAX_PAGES = int(os.getenv("META_ADS_MAX_PAGES", 10))
+META_ADS_COUNTRY = os.getenv("META_ADS_COUNTRY", "IN")
+META_ADS_API_URL = os.getenv(
+    "META_ADS_API_URL", "https://meta-ad-library.p.rapidapi.com"
+)
+_END_OF_PAGES = object()
 
-def search_meta_ads(keyword: str, continuation_token : str = "") -> dict:
+
+def search_meta_ads(
+    keyword: str, continuation_token : str = "", country_code: str = META_ADS_COUNTRY
+) -> dict:
     """Fetch ads from Meta Ad Library API using the generated keyword."""
-    if(continuation_token == ""):
-        url = f"https://meta-ad-library.p.rapidapi.com/search/ads?query={keyword}&active_status=active&media_types=all&ad_type=all&country_code=IN"
-    else:
-        url = f"https://meta-ad-library.p.rapidapi.com/search/ads?query={keyword}&continuation_token={continuation_token}&active_status=active&media_types=all&ad_type=all&country_code=IN"
-    
+    url = f"{META_ADS_API_URL}/search/ads"
+    # Passed as params so requests URL-encodes keywords like "bread & butter"
+    params = {
+        "query": keyword,
+        "active_status": "active",
+        "media_types": "all",
+        "ad_type": "all",
+        "country_code": country_code,
+    }
+    if continuation_token:
+        params["continuation_token"] = continuation_token
+
     headers = {
         "x-rapidapi-host": "meta-ad-library.p.rapidapi.com",
         "x-rapidapi-key": os.getenv("RAPIDAPI_KEY")  # Store your key in an environment variable
     }
-    res = requests.get(url, headers=headers)
+    with span(
+        "search_meta_ads",
+        keyword=keyword,
+        country_code=country_code,
+        continued=bool(continuation_token),
+    ) as page_span:
+        res = limiters["rapidapi"].call(
+            timed("rapidapi", "search/ads", _get_checked), url, headers, params
+        )
+        page = res.json()
+        if page_span:
+            page_span.set(ad_groups=len(page.get("results") or []))
+    log_sampled(
+        "meta_ads_page",
+        keyword=keyword,
+        country_code=country_code,
+        continued=bool(continuation_token),
+        ad_groups=len(page.get("results") or []),
+        response_bytes=len(res.content),
+    )
+    return page
+
+
+def _get_checked(url: str, headers: dict, params: dict):
+    res = http_client.get(url, headers=headers, params=params)
     res.raise_for_status()
-    return res.json()
+    return res
+
+
+async def stream_meta_ad_pages(
+    first_page: dict,
+    query: str | None = None,
+    read_ahead: int = META_ADS_READ_AHEAD,
+    max_pages: int = META_ADS_MAX_PAGES,
+    country_code: str = META_ADS_COUNTRY,
+):
+    """
+    Yields first_page and the pages following it, prefetching in the background.
+
+    While the caller works on page N, up to `read_ahead` following pages are fetched.
+    A page is only requested once a read-ahead slot is free, so stopping early never
+    leaves more than `read_ahead` unused fetches. Close the generator (e.g. with
+    contextlib.aclosing) to cancel the prefetch as soon as enough ads are collected.
+
+    Args:
+        first_page (dict): Already fetched Meta Ad Library response
+        query (str, optional): Search keyword, defaults to the query of first_page
+        read_ahead (int): Maximum number of pages fetched ahead of the caller
+        max_pages (int): Maximum number of pages yielded, including first_page
+        country_code (str): Market the following pages are fetched for
+    """
+    query = query or first_page.get("query")
+    pages = asyncio.Queue()
+    slots = asyncio.Semaphore(max(1, read_ahead))
+
+    async def prefetch(continuation_token: str | None):
+        try:
+            fetched = 1
+            while continuation_token and fetched < max_pages:
+                await slots.acquire()
+                page = await asyncio.to_thread(
+                    search_meta_ads, query, continuation_token, country_code
+                )
+                if not page.get("results"):
+                    print("Retrying fetch due to empty response")
+                    page = await asyncio.to_thread(
+                        search_meta_ads, query, continuation_token, country_code
+                    )
+                fetched += 1
+                pages.put_nowait(page)
+                continuation_token = page.get("continuation_token")
+        except Exception as e:
+            pages.put_nowait(e)
+        pages.put_nowait(_END_OF_PAGES)
+
+    prefetch_task = asyncio.create_task(
+        prefetch(first_page.get("continuation_token"))
+    )
+    try:
+        yield first_page
+        while True:
+            page = await pages.get()
+            if page is _END_OF_PAGES:
+                return
+            if isinstance(page, Exception):
+                raise page
+            slots.release()
+            yield page
+    finally:
+        prefetch_task.cancel()
+        await asyncio.gather(prefetch_task, return_exceptions=True)
@@ -0,0 +1,242 @@
+import os
+import json
+import time
+import random
+import threading
+from dotenv import load_dotenv
+from tracing import span
+load_dotenv(override=True)
+
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", 0.1))
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items())
+    return "{" + pairs + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter with labels, rendered in the Prometheus text format."""
+
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> list:
+        with self._lock:
+            return [
+                (self.name, dict(zip(self.labelnames, key)), value)
+                for key, value in sorted(self._values.items())
+            ]
+
+
+class Histogram:
+    """Cumulative-bucket histogram with labels, rendered in the Prometheus text format."""
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: tuple = (),
+        buckets: tuple = LATENCY_BUCKETS,
+    ):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {
+                    "buckets": [0] * len(self.buckets),
+                    "sum": 0.0,
+                    "count": 0,
+                }
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["buckets"][index] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def samples(self) -> list:
+        samples = []
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                labels = dict(zip(self.labelnames, key))
+                for bound, count in zip(self.buckets, series["buckets"]):
+                    bucket_labels = {**labels, "le": _format_value(bound)}
+                    samples.append((f"{self.name}_bucket", bucket_labels, count))
+                samples.append(
+                    (f"{self.name}_bucket", {**labels, "le": "+Inf"}, series["count"])
+                )
+                samples.append((f"{self.name}_sum", labels, series["sum"]))
+                samples.append((f"{self.name}_count", labels, series["count"]))
+        return samples
+
+
+class CallbackMetric:
+    """
+    Metric whose samples are read from existing counters when /metrics is scraped.
+
+    `read` returns a list of (labels dict, value) pairs.
+    """
+
+    def __init__(self, name: str, help: str, type: str, read):
+        self.name = name
+        self.help = help
+        self.type = type
+        self._read = read
+        registry.append(self)
+
+    def samples(self) -> list:
+        return [(self.name, labels, value) for labels, value in self._read()]
+
+
+registry = []
+
+
+def render() -> str:
+    """All registered metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in registry:
+        try:
+            samples = metric.samples()
+        except Exception as e:
+            print(f"Reading metric {metric.name} failed: {e}")
+            continue
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        for name, labels, value in samples:
+            if value is None:
+                continue
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+upstream_request_seconds = Histogram(
+    "upstream_request_seconds",
+    "Latency of single upstream requests, retries excluded",
+    ("upstream", "target", "outcome"),
+)
+upstream_errors_total = Counter(
+    "upstream_errors_total",
+    "Failed upstream requests by HTTP status (or 'none' for connection errors)",
+    ("upstream", "status"),
+)
+upstream_retries_total = Counter(
+    "upstream_retries_total", "Upstream requests retried after an error", ("upstream",)
+)
+upstream_hedges_total = Counter(
+    "upstream_hedges_total",
+    "Slow upstream calls raced against a hedged duplicate, by which one answered first",
+    ("upstream", "winner"),
+)
+llm_tokens_total = Counter(
+    "llm_tokens_total",
+    "Tokens reported in the usage field of Together AI responses",
+    ("model", "kind"),
+)
+llm_cost_usd_total = Counter(
+    "llm_cost_usd_total",
+    "Estimated Together AI spend from token usage and list prices",
+    ("model",),
+)
+http_request_seconds = Histogram(
+    "http_request_seconds",
+    "Latency of API requests until the response headers are sent",
+    ("method", "route", "status"),
+)
+cache_requests_total = Counter(
+    "cache_requests_total", "Cache lookups by cache and result", ("cache", "result")
+)
+
+
+def timed(upstream: str, target: str, fn):
+    """
+    Wraps a sync upstream call so each attempt is recorded in upstream_request_seconds
+    and traced as a span.
+    """
+
+    def call(*args, **kwargs):
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            with span(f"{upstream} {target}", upstream=upstream, target=target):
+                result = fn(*args, **kwargs)
+            outcome = "ok"
+            return result
+        finally:
+            upstream_request_seconds.observe(
+                time.perf_counter() - started,
+                upstream=upstream,
+                target=target,
+                outcome=outcome,
+            )
+
+    return call
+
+
+def timed_async(upstream: str, target: str, fn):
+    """Async variant of timed."""
+
+    async def call(*args, **kwargs):
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            with span(f"{upstream} {target}", upstream=upstream, target=target):
+                result = await fn(*args, **kwargs)
+            outcome = "ok"
+            return result
+        finally:
+            upstream_request_seconds.observe(
+                time.perf_counter() - started,
+                upstream=upstream,
+                target=target,
+                outcome=outcome,
+            )
+
+    return call
+
+
+def log_sampled(event: str, rate: float = LOG_SAMPLE_RATE, **fields):
+    """
+    Prints a structured JSON log line for a random `rate` share of calls.
+
+    Used instead of dumping whole payloads on every call; pass sizes and ids
+    rather than the payload itself.
+    """
+    if rate >= 1 or random.random() < rate:
+        print(json.dumps({"event": event, **fields}, default=str, ensure_ascii=False))
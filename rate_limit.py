@@ -0,0 +1,461 @@
+import os
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+import aiohttp
+import requests
+import together
+from tenacity import (
+    Retrying,
+    AsyncRetrying,
+    retry_if_exception,
+    stop_after_attempt,
+    wait_random_exponential,
+)
+from dotenv import load_dotenv
+import deadline
+from deadline import DeadlineExceeded
+from metrics import (
+    upstream_errors_total,
+    upstream_retries_total,
+    upstream_hedges_total,
+)
+load_dotenv(override=True)
+
+UPSTREAM_MAX_ATTEMPTS = int(os.getenv("UPSTREAM_MAX_ATTEMPTS", 4))
+UPSTREAM_BACKOFF_MAX = float(os.getenv("UPSTREAM_BACKOFF_MAX", 30))
+
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "true").lower() == "true"
+# A hedged duplicate is sent once a call is slower than this percentile of recent calls
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", 95))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", 20))
+HEDGE_WINDOW = int(os.getenv("HEDGE_WINDOW", 200))
+
+# Requests per second, burst size and concurrency ceiling per provider
+UPSTREAM_DEFAULTS = {
+    "together": {"rate": 10, "burst": 20, "max_concurrency": 32},
+    "rapidapi": {"rate": 5, "burst": 5, "max_concurrency": 4},
+    "recraft": {"rate": 2, "burst": 4, "max_concurrency": 4},
+}
+
+# Connection drops and timeouts of the HTTP clients used for upstream calls
+_TRANSIENT_ERRORS = (
+    ConnectionError,
+    TimeoutError,
+    asyncio.TimeoutError,
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+    aiohttp.ClientConnectionError,
+    aiohttp.ClientPayloadError,
+    aiohttp.ServerTimeoutError,
+    together.APIConnectionError,
+)
+
+
+def _status_code(exc: Exception) -> int | None:
+    """HTTP status of an upstream error from requests, aiohttp or the Together SDK."""
+    response = getattr(exc, "response", None)
+    for status in (
+        getattr(response, "status_code", None),
+        getattr(exc, "status", None),
+        getattr(exc, "http_status", None),
+        getattr(exc, "status_code", None),
+    ):
+        if isinstance(status, int):
+            return status
+    return None
+
+
+def _retry_after(exc: Exception) -> float | None:
+    """Seconds from a Retry-After header on the error, if the upstream sent one."""
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None) or getattr(exc, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("Retry-After") or headers.get("retry-after")
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable(exc: Exception) -> bool:
+    """Retries throttling, upstream 5xx and connection-level failures, not client errors."""
+    if isinstance(exc, DeadlineExceeded):
+        return False
+    status = _status_code(exc)
+    if status is not None:
+        return status == 429 or status >= 500
+    return isinstance(exc, _TRANSIENT_ERRORS)
+
+
+class _WaitRetryAfter:
+    """Tenacity wait: Retry-After when the upstream sent it, else jittered exponential."""
+
+    def __init__(self):
+        self._fallback = wait_random_exponential(multiplier=0.5, max=UPSTREAM_BACKOFF_MAX)
+
+    def __call__(self, retry_state) -> float:
+        exc = retry_state.outcome.exception()
+        retry_after = _retry_after(exc) if exc else None
+        if retry_after is not None:
+            wait = min(retry_after, UPSTREAM_BACKOFF_MAX) + random.uniform(0, 0.25)
+        else:
+            wait = self._fallback(retry_state)
+        # Never sleep past the request deadline; the next attempt then fails fast
+        budget = deadline.remaining()
+        return wait if budget is None else max(0.0, min(wait, budget))
+
+
+def _stop_at_deadline(retry_state) -> bool:
+    return deadline.expired()
+
+
+class LatencyTracker:
+    """Recent latencies of successful calls per key, for the hedging threshold."""
+
+    def __init__(self, window: int = HEDGE_WINDOW):
+        self.window = window
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, key, seconds: float):
+        with self._lock:
+            samples = self._samples.get(key)
+            if samples is None:
+                samples = self._samples[key] = deque(maxlen=self.window)
+            samples.append(seconds)
+
+    def percentile(self, key, q: float, min_samples: int = HEDGE_MIN_SAMPLES):
+        """Nearest-rank percentile, or None with fewer than min_samples samples."""
+        with self._lock:
+            samples = sorted(self._samples.get(key) or ())
+        if len(samples) < max(1, min_samples):
+            return None
+        rank = max(1, round(q / 100 * len(samples)))
+        return samples[min(rank, len(samples)) - 1]
+
+
+class _SlotWaiter:
+    """A caller queued for a limiter slot, woken (from any thread) when it may retry."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop | None = None):
+        self.queued = False
+        self._loop = loop
+        self._event = asyncio.Event() if loop is not None else threading.Event()
+
+    def wake(self):
+        if self._loop is None:
+            self._event.set()
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._event.set)
+        except RuntimeError:
+            pass  # The waiting loop is gone
+
+    def wait(self, timeout: float | None):
+        self._event.wait(timeout)
+        self._event.clear()
+
+    async def wait_async(self, timeout: float | None):
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._event.clear()
+
+
+class UpstreamLimiter:
+    """
+    Adaptive limiter for one upstream provider.
+
+    A token bucket caps the request rate and an AIMD window caps concurrency: every
+    success grows the window by 1/window (about +1 per round trip), every 429
+    halves it and pauses new requests for Retry-After seconds. Calls go through
+    call()/call_async(), which also retry with jittered exponential backoff, and
+    neither start nor outlive the current request deadline (see deadline.py).
+    call_hedged_async() additionally races a duplicate against slow calls.
+    """
+
+    def __init__(self, name: str, rate: float, burst: int, max_concurrency: int):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.window = max(1.0, max_concurrency / 4)
+        self.in_flight = 0
+        self.throttled = 0
+        self.retries = 0
+        self.hedged = 0
+        self.latencies = LatencyTracker()
+        self._tokens = float(burst)
+        self._refilled_at = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+        self._waiters = deque()
+
+    def _try_acquire(self, waiter: _SlotWaiter | None = None) -> float | None:
+        """
+        Takes a slot and a token, returning 0, how long to wait before trying again,
+        or None to wait until woken by a freed slot.
+
+        Slots are handed out in arrival order: a waiter that can't proceed is queued,
+        and while others are queued only the first of them may take a slot. Without
+        a waiter (hedges) a slot is only taken if nobody is queued.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._refilled_at) * self.rate
+            )
+            self._refilled_at = now
+            if self._waiters and self._waiters[0] is not waiter:
+                delay = None
+            elif now < self._blocked_until:
+                delay = self._blocked_until - now
+            elif self.in_flight >= int(self.window):
+                delay = None
+            elif self._tokens < 1:
+                delay = (1 - self._tokens) / self.rate
+            else:
+                self._tokens -= 1
+                self.in_flight += 1
+                if waiter is not None and waiter.queued:
+                    self._waiters.popleft()
+                    waiter.queued = False
+                    # There may be room for the next one too
+                    self._wake_next()
+                return 0.0
+            if waiter is not None and not waiter.queued:
+                self._waiters.append(waiter)
+                waiter.queued = True
+            return delay
+
+    def _wake_next(self):
+        if self._waiters:
+            self._waiters[0].wake()
+
+    def _leave(self, waiter: _SlotWaiter):
+        """Dequeues a waiter that gave up, passing its turn on."""
+        with self._lock:
+            if waiter.queued:
+                was_first = self._waiters[0] is waiter
+                self._waiters.remove(waiter)
+                waiter.queued = False
+                if was_first:
+                    self._wake_next()
+
+    def _acquire(self):
+        waiter = _SlotWaiter()
+        try:
+            while (delay := self._try_acquire(waiter)) != 0:
+                waiter.wait(self._wait_timeout(delay))
+        except BaseException:
+            self._leave(waiter)
+            raise
+
+    async def _acquire_async(self):
+        waiter = _SlotWaiter(asyncio.get_running_loop())
+        try:
+            while (delay := self._try_acquire(waiter)) != 0:
+                await waiter.wait_async(self._wait_timeout(delay))
+        except BaseException:
+            self._leave(waiter)
+            raise
+
+    def _abandon(self):
+        """Frees the slot of a call that was cancelled, without adapting the window."""
+        with self._lock:
+            self.in_flight -= 1
+            self._wake_next()
+
+    def _release(self, exc: Exception | None):
+        with self._lock:
+            self.in_flight -= 1
+            self._wake_next()
+            if exc is None:
+                self.window = min(self.max_concurrency, self.window + 1 / self.window)
+                return
+            upstream_errors_total.inc(
+                upstream=self.name, status=_status_code(exc) or "none"
+            )
+            if _status_code(exc) == 429:
+                self.throttled += 1
+                self.window = max(1.0, self.window / 2)
+                retry_after = _retry_after(exc)
+                if retry_after:
+                    self._blocked_until = max(
+                        self._blocked_until, time.monotonic() + retry_after
+                    )
+
+    def _retrying_kwargs(self) -> dict:
+        def before_sleep(retry_state):
+            self.retries += 1
+            upstream_retries_total.inc(upstream=self.name)
+            print(
+                f"Retrying {self.name} call after error: {retry_state.outcome.exception()}"
+            )
+
+        return {
+            "retry": retry_if_exception(is_retryable),
+            "stop": stop_after_attempt(UPSTREAM_MAX_ATTEMPTS) | _stop_at_deadline,
+            "wait": _WaitRetryAfter(),
+            "before_sleep": before_sleep,
+            "reraise": True,
+        }
+
+    def call(self, fn, *args, **kwargs):
+        """Runs fn under the limiter from sync code, retrying retryable failures."""
+        for attempt in Retrying(**self._retrying_kwargs()):
+            with attempt:
+                deadline.check(f"{self.name} call")
+                self._acquire()
+                try:
+                    result = fn(*args, **kwargs)
+                except DeadlineExceeded:
+                    self._abandon()
+                    raise
+                except Exception as e:
+                    self._release(e)
+                    raise
+                except BaseException:
+                    self._abandon()
+                    raise
+                self._release(None)
+        return result
+
+    def _wait_timeout(self, delay: float | None) -> float | None:
+        """How long to wait for a slot: `delay`, or until woken, within the deadline."""
+        budget = deadline.remaining()
+        out_of_time = budget is not None and (
+            budget <= 0 or (delay is not None and delay >= budget)
+        )
+        if out_of_time:
+            raise DeadlineExceeded(
+                f"Request deadline exceeded waiting for a {self.name} slot"
+            )
+        return budget if delay is None else delay
+
+    async def _attempt_async(self, fn, args, kwargs, key=None, acquired=False):
+        """One attempt of fn under a slot, cut off at the request deadline."""
+        if not acquired:
+            await self._acquire_async()
+        started = time.monotonic()
+        try:
+            async with deadline.enforce(f"{self.name} call"):
+                result = await fn(*args, **kwargs)
+        except (asyncio.CancelledError, DeadlineExceeded):
+            self._abandon()
+            raise
+        except Exception as e:
+            self._release(e)
+            raise
+        self._release(None)
+        if key is not None:
+            self.latencies.record(key, time.monotonic() - started)
+        return result
+
+    async def call_async(self, fn, *args, **kwargs):
+        """Awaits fn(*args, **kwargs) under the limiter, retrying retryable failures."""
+        async for attempt in AsyncRetrying(**self._retrying_kwargs()):
+            with attempt:
+                result = await self._attempt_async(fn, args, kwargs)
+        return result
+
+    async def _hedged_attempt_async(self, key, fn, args, kwargs):
+        primary = asyncio.ensure_future(self._attempt_async(fn, args, kwargs, key))
+        tasks, hedge = {primary}, None
+        try:
+            threshold = (
+                self.latencies.percentile(key, HEDGE_PERCENTILE)
+                if HEDGE_ENABLED
+                else None
+            )
+            if threshold is not None:
+                done, _ = await asyncio.wait(tasks, timeout=threshold)
+                budget = deadline.remaining()
+                # Hedges only use spare capacity; they never queue behind other calls
+                if (
+                    not done
+                    and (budget is None or budget > 0)
+                    and self._try_acquire() == 0
+                ):
+                    hedge = asyncio.ensure_future(
+                        self._attempt_async(fn, args, kwargs, key, acquired=True)
+                    )
+                    tasks.add(hedge)
+                    with self._lock:
+                        self.hedged += 1
+
+            # The first successful response wins; the other call is cancelled
+            error = None
+            while tasks:
+                done, tasks = await asyncio.wait(
+                    tasks, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        if hedge is not None:
+                            upstream_hedges_total.inc(
+                                upstream=self.name,
+                                winner="hedge" if task is hedge else "primary",
+                            )
+                        return task.result()
+                    error = error or task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def call_hedged_async(self, key, fn, *args, **kwargs):
+        """
+        call_async for idempotent calls: once an attempt takes longer than the
+        HEDGE_PERCENTILE latency of recent calls with the same key, a duplicate is
+        sent if the limiter has a free slot, and whichever succeeds first is used.
+
+        Args:
+            key: Groups calls with comparable latency, e.g. model and response schema
+        """
+        async for attempt in AsyncRetrying(**self._retrying_kwargs()):
+            with attempt:
+                result = await self._hedged_attempt_async(key, fn, args, kwargs)
+        return result
+
+    def limits(self) -> dict:
+        with self._lock:
+            return {
+                "rate_per_second": self.rate,
+                "burst": self.burst,
+                "concurrency_window": round(self.window, 2),
+                "max_concurrency": self.max_concurrency,
+                "in_flight": self.in_flight,
+                "throttled": self.throttled,
+                "retries": self.retries,
+                "hedged": self.hedged,
+            }
+
+
+def _limiter_from_env(name: str) -> UpstreamLimiter:
+    defaults = UPSTREAM_DEFAULTS[name]
+    prefix = name.upper()
+    return UpstreamLimiter(
+        name,
+        rate=float(os.getenv(f"{prefix}_RATE_LIMIT", defaults["rate"])),
+        burst=int(os.getenv(f"{prefix}_BURST", defaults["burst"])),
+        max_concurrency=int(
+            os.getenv(f"{prefix}_MAX_CONCURRENCY", defaults["max_concurrency"])
+        ),
+    )
+
+
+limiters = {name: _limiter_from_env(name) for name in UPSTREAM_DEFAULTS}
+
+
+def upstream_limits() -> dict:
+    """Current limits and counters of every upstream provider."""
+    return {name: limiter.limits() for name, limiter in limiters.items()}
@@ -0,0 +1,104 @@
+import asyncio
+import threading
+import contextvars
+import deadline
+from deadline import DeadlineExceeded, SharedDeadline
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical calls into one in-flight computation.
+
+    The first caller for a key starts the work; callers arriving while it runs
+    wait for the same result or exception. A waiter that is cancelled only
+    detaches itself; the shared work is cancelled once no waiters are left.
+
+    Async work runs until the latest request deadline of its waiters rather than
+    the first caller's, and each waiter gives up at its own deadline.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0
+        self.coalesced = 0
+        self._async_calls = {}
+        self._sync_calls = {}
+        self._sync_lock = threading.Lock()
+
+    async def do(self, key, coro_fn):
+        """Awaits coro_fn() once per key across concurrent callers."""
+        self.calls += 1
+        entry = self._async_calls.get(key)
+        # A task that is done or being cancelled can't be joined; start a new one
+        if entry is None or entry["task"].done() or entry["task"].cancelling():
+            shared = SharedDeadline()
+            shared.join()
+            # The work must not inherit (and be cut by) the first caller's deadline
+            context = contextvars.copy_context()
+            context.run(deadline.share, shared)
+            task = asyncio.create_task(coro_fn(), context=context)
+            entry = {"task": task, "deadline": shared, "waiters": 0}
+            self._async_calls[key] = entry
+            task.add_done_callback(lambda _: self._forget(key, task))
+        else:
+            self.coalesced += 1
+            entry["deadline"].join()
+
+        entry["waiters"] += 1
+        try:
+            return await entry["deadline"].wait(entry["task"])
+        except (asyncio.CancelledError, DeadlineExceeded):
+            if not entry["task"].done() and entry["waiters"] == 1:
+                # Forget it now: the done callback only runs once the task unwinds
+                self._forget(key, entry["task"])
+                entry["task"].cancel()
+            raise
+        finally:
+            entry["waiters"] -= 1
+
+    def _forget(self, key, task):
+        entry = self._async_calls.get(key)
+        if entry is not None and entry["task"] is task:
+            del self._async_calls[key]
+
+    def call(self, key, fn):
+        """Runs fn() once per key across concurrent threads."""
+        with self._sync_lock:
+            self.calls += 1
+            entry = self._sync_calls.get(key)
+            leader = entry is None
+            if leader:
+                entry = self._sync_calls[key] = {"done": threading.Event()}
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            if not entry["done"].wait(deadline.remaining()):
+                raise DeadlineExceeded(
+                    f"Request deadline exceeded waiting for {self.name}"
+                )
+            error = entry.get("error")
+            if isinstance(error, DeadlineExceeded) and not deadline.expired():
+                # The leader ran out of its own budget; this caller still has time
+                return self.call(key, fn)
+            if error is not None:
+                raise error
+            return entry["result"]
+
+        try:
+            entry["result"] = fn()
+            return entry["result"]
+        except BaseException as e:
+            entry["error"] = e
+            raise
+        finally:
+            with self._sync_lock:
+                del self._sync_calls[key]
+            entry["done"].set()
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._async_calls) + len(self._sync_calls),
+        }
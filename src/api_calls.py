@@ -1,13 +1,22 @@
+import json
 import requests
+from requests.adapters import HTTPAdapter
 # base_uri = 'https://sour-panther-bharatavjo-fca7ad2f.koyeb.app'
 base_uri = 'http://localhost:8000'
+CONNECT_TIMEOUT = 5
+
+# Keep-alive connection pool to the backend, shared by every call below.
+# The frontend is deployed on its own, so it can't import the backend's http_client.
+session = requests.Session()
+session.mount("http://", HTTPAdapter(pool_maxsize=10))
+session.mount("https://", HTTPAdapter(pool_maxsize=10))
 
 
 # First API call to get competitor ads
 def get_competitor_ads(company_name, product_name) -> list:
     url = f"{base_uri}/analyze-competitor-ads"
     payload = {"company_name": company_name, "product_name": product_name}
-    res = requests.post(url, json=payload, timeout=120)
+    res = session.post(url, json=payload, timeout=(CONNECT_TIMEOUT, 120))
     res.raise_for_status()
     return res.json()  # Expected to be a list of 5 competitor ad objects
 
@@ -16,11 +25,63 @@ def get_competitor_ads(company_name, product_name) -> list:
 def generate_creative_ideas(competitor_ads, product_name) -> list:
     url = f"{base_uri}/generate-ad-ideas"
     payload = {"competitor_ads": competitor_ads, "product_name": product_name}
-    res = requests.post(url, json=payload, timeout=1200)
+    res = session.post(url, json=payload, timeout=(CONNECT_TIMEOUT, 1200))
     res.raise_for_status()
     return res.json()  # Expected to be a list of 5 creative ideas
 
 
+def _stream_events(url, payload, timeout):
+    """Yields the JSON events of an NDJSON streaming endpoint, raising on an error event."""
+    with session.post(
+        url, json=payload, stream=True, timeout=(CONNECT_TIMEOUT, timeout)
+    ) as res:
+        res.raise_for_status()
+        for line in res.iter_lines(decode_unicode=True):
+            if not line:
+                continue
+            event = json.loads(line)
+            if event["event"] == "error":
+                raise RuntimeError(event["detail"])
+            yield event
+
+
+# Streaming variant: yields {"event": "ad", "ad": {...}} as each ad is validated,
+# then {"event": "summary", ...}
+def stream_competitor_ads(company_name, product_name):
+    url = f"{base_uri}/analyze-competitor-ads/stream"
+    payload = {"company_name": company_name, "product_name": product_name}
+    yield from _stream_events(url, payload, timeout=120)
+
+
+# Streaming variant: yields {"event": "idea", "index": i, "idea": {...}} as each idea
+# is ready, then {"event": "summary", ...}
+def stream_creative_ideas(competitor_ads, product_name):
+    url = f"{base_uri}/generate-ad-ideas/stream"
+    payload = {"competitor_ads": competitor_ads, "product_name": product_name}
+    yield from _stream_events(url, payload, timeout=1200)
+
+
+# Analysis and ideation in one call: yields {"event": "ad", "position": [...], "ad": {...}}
+# as each ad is validated and {"event": "idea", "position": [...], "idea": {...}} once its
+# ideas are ready, then {"event": "summary", ...}
+def stream_pipeline(company_name, product_name):
+    url = f"{base_uri}/pipeline/stream"
+    payload = {"company_name": company_name, "product_name": product_name}
+    yield from _stream_events(url, payload, timeout=1200)
+
+
+# Catalog variant: yields {"event": "product", "index": i, "product_name": ..., "ads": [...]}
+# per product as soon as it is done, then {"event": "summary", ...}
+def stream_catalog(company_name, products, generate_ideas=False):
+    url = f"{base_uri}/catalog/stream"
+    payload = {
+        "company_name": company_name,
+        "products": products,
+        "generate_ideas": generate_ideas,
+    }
+    yield from _stream_events(url, payload, timeout=1200)
+
+
 # Final API calls for customized ad generation
 def create_final_ad_text(text_idea, company_name, product_name, custom_text) -> list:
     url = f"{base_uri}/generate-marketing-text"
@@ -30,7 +91,7 @@ def create_final_ad_text(text_idea, company_name, product_name, custom_text) ->
         "product_name": product_name,
         "user_input": custom_text,
     }
-    res = requests.post(url, json=payload, timeout=60)
+    res = session.post(url, json=payload, timeout=(CONNECT_TIMEOUT, 60))
     res.raise_for_status()
     return res.json()  # Expected to be the final ad text
 
@@ -43,6 +104,6 @@ def create_final_ad_image(image_idea) -> list:
     }
     url = f"{base_uri}/ggenerate-marketing-image"
     payload = {"prompt": image_idea, "style": "digital_illustration"}
-    res = requests.post(url, json=payload, timeout=60)
+    res = session.post(url, json=payload, timeout=(CONNECT_TIMEOUT, 60))
     res.raise_for_status()
     return res.json()  # Expected to be the final ad image URL
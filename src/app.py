@@ -1,7 +1,7 @@
 import streamlit as st
 from api_calls import (
-    get_competitor_ads,
-    generate_creative_ideas,
+    stream_pipeline,
+    stream_creative_ideas,
     create_final_ad_text,
     create_final_ad_image,
 )
@@ -13,6 +13,8 @@ if "competitor_ads" not in st.session_state:
     st.session_state.competitor_ads = None
 if "creative_ideas" not in st.session_state:
     st.session_state.creative_ideas = None
+if "ideas_retried" not in st.session_state:
+    st.session_state.ideas_retried = False
 if "chosen_ad" not in st.session_state:
     st.session_state.chosen_ad = None
 if "custom_text" not in st.session_state:
@@ -60,10 +62,31 @@ if company_name and company_description:
         st.write("Analyzing competitor ads for:", product_name)
 
         if st.session_state.competitor_ads is None:
-            with st.spinner("Fetching competitors' ads..."):
+            with st.spinner("Fetching competitors' ads and generating ideas..."):
+                progress = st.empty()
+                ads, ideas = {}, {}
                 try:
-                    competitor_ads_json = get_competitor_ads(company_name, product_name)
-                    st.session_state.competitor_ads = competitor_ads_json["ads"]
+                    # The server generates ideas for each ad as soon as it is
+                    # validated, so both arrive over one stream
+                    for event in stream_pipeline(company_name, product_name):
+                        position = tuple(event.get("position", ()))
+                        if event["event"] == "ad":
+                            ads[position] = event["ad"]
+                        elif event["event"] == "idea":
+                            ideas[position] = event["idea"]
+                        else:
+                            continue
+                        progress.write(
+                            f"Found ads from: {', '.join(ad['page_name'] for ad in ads.values())} "
+                            f"({len(ideas)}/{len(ads)} ideas ready)"
+                        )
+                    progress.empty()
+                    positions = sorted(ads)
+                    st.session_state.competitor_ads = [ads[p] for p in positions]
+                    # One entry per ad, None where ideation failed
+                    st.session_state.creative_ideas = [
+                        ideas.get(p) for p in positions
+                    ]
                 except Exception as e:
                     st.error(f"Error fetching competitor ads: {str(e)}")
                     st.stop()
@@ -75,25 +98,40 @@ if company_name and company_description:
             print(competitor_names)
             st.write(f"Analyzing ads from competitors: {', '.join(competitor_names)}")
 
-            # Step 4: Generate Creative Ideas Based on Competitor Ads
-            if st.session_state.creative_ideas is None:
-                with st.spinner("Generating creative ad ideas..."):
+            # Step 4: Retry ideation once for the ads whose ideas failed in the pipeline
+            missing = [
+                index
+                for index, idea in enumerate(st.session_state.creative_ideas)
+                if idea is None
+            ]
+            if missing and not st.session_state.ideas_retried:
+                st.session_state.ideas_retried = True
+                with st.spinner("Generating the missing creative ad ideas..."):
+                    progress = st.progress(0.0)
                     try:
-                        creative_ideas_json = generate_creative_ideas(
-                            st.session_state.competitor_ads, product_name
-                        )
-                        st.session_state.creative_ideas = creative_ideas_json[
-                            "ad_ideas"
-                        ]
+                        ready = 0
+                        for event in stream_creative_ideas(
+                            [st.session_state.competitor_ads[i] for i in missing],
+                            product_name,
+                        ):
+                            if event["event"] == "idea":
+                                index = missing[event["index"]]
+                                st.session_state.creative_ideas[index] = event["idea"]
+                                ready += 1
+                                progress.progress(ready / len(missing))
+                        progress.empty()
                     except Exception as e:
                         st.error(f"Error generating creative ideas: {str(e)}")
-                        st.stop()
 
-            if st.session_state.creative_ideas:
+            if any(st.session_state.creative_ideas):
                 # Step 5: Display Generated Creative Ideas
                 st.header("Ad Creative Ideas")
 
                 for i, idea in enumerate(st.session_state.creative_ideas, start=1):
+                    if idea is None:
+                        # Numbered like its ad, so the remaining cards stay aligned
+                        st.caption(f"No idea could be generated for ad {i}")
+                        continue
                     st.markdown(
                         """
                         <style>
@@ -1,11 +1,64 @@
 import os
 import json
+import math
+import asyncio
+import threading
+import aiohttp
 from dotenv import load_dotenv
 from typing import Literal
 from together import Together
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, ValidationError
+from llm_cache import llm_cache, make_cache_key, LLM_CACHE_ENABLED
+from http_client import get_async_session, HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT
+from rate_limit import limiters
+from single_flight import SingleFlight
+from ad_text import estimate_tokens, prepare_ad_copy
+from ad_images import thumbnail_data_url, thumbnail_data_url_async
+from metrics import (
+    timed,
+    timed_async,
+    log_sampled,
+    llm_tokens_total,
+    llm_cost_usd_total,
+    cache_requests_total,
+)
+from tracing import traced
 load_dotenv(override=True)
-together = Together(api_key=os.getenv('TOGETHER_API_KEY'))
+TOGETHER_BASE_URL = os.getenv("TOGETHER_BASE_URL", "https://api.together.xyz/v1")
+# Retries are left to limiters["together"], which also backs off on 429s
+together = Together(
+    api_key=os.getenv('TOGETHER_API_KEY'), base_url=TOGETHER_BASE_URL, max_retries=0
+)
+
+TOGETHER_CHAT_URL = f"{TOGETHER_BASE_URL}/chat/completions"
+TOGETHER_TEXT_MODEL = "meta-llama/Meta-Llama-3.1-8B-Instruct-Turbo"
+TOGETHER_VISION_MODEL = "meta-llama/Llama-3.2-11B-Vision-Instruct-Turbo"
+TOGETHER_TIMEOUT = float(os.getenv("TOGETHER_TIMEOUT", 120))
+RELEVANCE_BATCH_TOKEN_BUDGET = int(os.getenv("RELEVANCE_BATCH_TOKEN_BUDGET", 3000))
+RELEVANCE_BATCH_MAX_ADS = int(os.getenv("RELEVANCE_BATCH_MAX_ADS", 10))
+
+MODEL_CASCADE_ENABLED = os.getenv("MODEL_CASCADE_ENABLED", "true").lower() == "true"
+# Models tried in order, cheapest first; the last one always decides
+MODEL_CASCADE = [
+    model.strip()
+    for model in os.getenv(
+        "MODEL_CASCADE", f"meta-llama/Llama-3.2-3B-Instruct-Turbo,{TOGETHER_TEXT_MODEL}"
+    ).split(",")
+    if model.strip()
+] or [TOGETHER_TEXT_MODEL]
+RELEVANCE_CASCADE_CONFIDENCE = float(os.getenv("RELEVANCE_CASCADE_CONFIDENCE", 0.9))
+KEYWORD_CASCADE_CONFIDENCE = float(os.getenv("KEYWORD_CASCADE_CONFIDENCE", 0.6))
+
+# USD per million (prompt, completion) tokens, for the cost estimate in /metrics
+TOGETHER_PRICES_PER_MILLION_TOKENS = {
+    "meta-llama/Llama-3.2-3B-Instruct-Turbo": (0.06, 0.06),
+    "meta-llama/Meta-Llama-3.1-8B-Instruct-Turbo": (0.18, 0.18),
+    "meta-llama/Llama-3.2-11B-Vision-Instruct-Turbo": (0.18, 0.18),
+    "meta-llama/Meta-Llama-3.1-70B-Instruct-Turbo": (0.88, 0.88),
+}
+
+# Identical prompts in flight at the same time share one Together AI call
+llm_flight = SingleFlight("together")
 
 
 class AnalysisResult(BaseModel):
@@ -24,6 +77,30 @@ class RelevanceResponse(BaseModel):
         json_schema_extra = {"example": {"is_relevant": "yes"}}
 
 
+class AdRelevance(BaseModel):
+    ad_number: int = Field(description="Number of the ad as listed in the prompt")
+    is_relevant: Literal["yes", "no"] = Field(
+        description="Indicates whether the ad text is relevant to the keyword",
+        examples=["yes", "no"],
+    )
+
+
+class BatchRelevanceResponse(BaseModel):
+    results: list[AdRelevance] = Field(
+        description="One relevance verdict per ad, in the order the ads were listed"
+    )
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "results": [
+                    {"ad_number": 1, "is_relevant": "yes"},
+                    {"ad_number": 2, "is_relevant": "no"},
+                ]
+            }
+        }
+
+
 class AdvertisementIdea(BaseModel):
     idea_of_ad: str = Field(
         ...,
@@ -38,60 +115,442 @@ class AdvertisementText(BaseModel):
     )
 
 
-def analyze_text(
-    prompt: str, schema, model: str = "meta-llama/Meta-Llama-3.1-8B-Instruct-Turbo"
-) -> str:
-    """Generalized function to call Together AI with a prompt and return a JSON response."""
-    extract = together.chat.completions.create(
-        messages=[
-            {
-                "role": "system",
-                "content": "Analyze the input text and respond in JSON format.",
-            },
-            {"role": "user", "content": prompt},
-        ],
+def _text_messages(prompt: str) -> list:
+    return [
+        {
+            "role": "system",
+            "content": "Analyze the input text and respond in JSON format.",
+        },
+        {"role": "user", "content": prompt},
+    ]
+
+
+def _text_image_messages(prompt: str, image_url: str) -> list:
+    return [
+        # {"role": "system", "content": "Analyze the input text and image and respond in JSON format."},
+        {
+            "role": "user",
+            "content": [
+                {"type": "text", "text": prompt},
+                {
+                    "type": "image_url",
+                    "image_url": {
+                        "url": image_url,
+                    },
+                },
+            ],
+        },
+    ]
+
+
+def _cache_lookup(key: str):
+    if not LLM_CACHE_ENABLED:
+        return None
+    value = llm_cache.get(key)
+    cache_requests_total.inc(cache="llm", result="miss" if value is None else "hit")
+    return value
+
+
+def _record_usage(model: str, extract):
+    """Counts the prompt/completion tokens and estimated cost of a Together AI response."""
+    if isinstance(extract, dict):
+        usage = extract.get("usage") or {}
+    else:
+        usage = getattr(extract, "usage", None)
+        usage = usage.model_dump() if usage is not None else {}
+    prompt_price, completion_price = TOGETHER_PRICES_PER_MILLION_TOKENS.get(
+        model, (0.0, 0.0)
+    )
+    prompt_tokens = usage.get("prompt_tokens") or 0
+    completion_tokens = usage.get("completion_tokens") or 0
+    llm_tokens_total.inc(prompt_tokens, model=model, kind="prompt")
+    llm_tokens_total.inc(completion_tokens, model=model, kind="completion")
+    llm_cost_usd_total.inc(
+        (prompt_tokens * prompt_price + completion_tokens * completion_price)
+        / 1_000_000,
         model=model,
-        response_format={"type": "json_object", "schema": schema.model_json_schema()},
     )
 
-    output = json.loads(extract.choices[0].message.content)
-    return output
+
+def _cache_store(key: str, value):
+    if LLM_CACHE_ENABLED:
+        llm_cache.set(key, value)
+
+
+def _cacheable(output, schema, validate=None) -> bool:
+    """
+    Whether a response is worth caching: it parses as `schema` and passes `validate`.
+
+    Invalid answers are still returned to the caller (which decides whether to retry
+    or escalate), but never cached, so the next identical call asks the model again.
+    Unstructured answers (plain text of calls without response_format) are cached
+    whenever they are non-empty.
+
+    Args:
+        output: Parsed JSON response, or the raw content of an unstructured one
+        schema: Pydantic model the response should match
+        validate (callable, optional): Extra check raising ValueError on a bad response
+    """
+    if isinstance(output, str):
+        return bool(output.strip())
+    try:
+        schema.model_validate(output)
+        if validate is not None:
+            validate(output)
+    except ValueError as e:
+        if isinstance(e, ValidationError):
+            reason = "; ".join(
+                f"{'.'.join(map(str, error['loc']))}: {error['msg']}"
+                for error in e.errors()
+            )
+        else:
+            reason = str(e)
+        print(f"Not caching invalid {schema.__name__} response: {reason}")
+        return False
+    return True
+
+
+def analyze_text(
+    prompt: str, schema, model: str = TOGETHER_TEXT_MODEL, validate=None
+) -> str:
+    """
+    Generalized function to call Together AI with a prompt and return a JSON response.
+
+    Only responses matching `schema` (and passing `validate`, if given) are cached.
+    """
+    messages = _text_messages(prompt)
+    json_schema = schema.model_json_schema()
+    cache_key = make_cache_key(model, messages, json_schema)
+    cached = _cache_lookup(cache_key)
+    if cached is not None:
+        return cached
+
+    def fetch():
+        extract = limiters["together"].call(
+            timed("together", model, together.chat.completions.create),
+            messages=messages,
+            model=model,
+            response_format={"type": "json_object", "schema": json_schema},
+        )
+        _record_usage(model, extract)
+        output = json.loads(extract.choices[0].message.content)
+        if _cacheable(output, schema, validate):
+            _cache_store(cache_key, output)
+        return output
+
+    return llm_flight.call(cache_key, fetch)
 
 
 def analyze_text_image(
     prompt: str,
     image_url: str,
     schema,
-    model: str = "meta-llama/Llama-3.2-11B-Vision-Instruct-Turbo",
+    model: str = TOGETHER_VISION_MODEL,
 ) -> str:
     """Generalized function to call Together AI with a prompt and return a JSON response."""
-    print(prompt, image_url, schema)
-    extract = together.chat.completions.create(
-        messages=[
-            # {"role": "system", "content": "Analyze the input text and image and respond in JSON format."},
+    log_sampled(
+        "together_vision_call",
+        model=model,
+        prompt_chars=len(prompt),
+        inline_image=image_url.startswith("data:"),
+        image_chars=len(image_url),
+    )
+    messages = _text_image_messages(prompt, image_url)
+    cache_key = make_cache_key(model, messages, schema.model_json_schema())
+    cached = _cache_lookup(cache_key)
+    if cached is not None:
+        return cached
+
+    def fetch():
+        extract = limiters["together"].call(
+            timed("together", model, together.chat.completions.create),
+            messages=messages,
+            model=model,
+            # response_format={"type": "json_object", "schema": schema.model_json_schema()},
+        )
+        _record_usage(model, extract)
+        output = extract.choices[0].message.content
+        if _cacheable(output, schema):
+            _cache_store(cache_key, output)
+        return output
+
+    return llm_flight.call(cache_key, fetch)
+
+
+async def _chat_completion_async(payload: dict) -> dict:
+    session = await get_async_session()
+    async with session.post(
+        TOGETHER_CHAT_URL,
+        json=payload,
+        headers={"Authorization": f'Bearer {os.getenv("TOGETHER_API_KEY")}'},
+        # Keep the pooled session's connect/read limits; only the total is per call
+        timeout=aiohttp.ClientTimeout(
+            total=TOGETHER_TIMEOUT,
+            connect=HTTP_CONNECT_TIMEOUT,
+            sock_read=HTTP_READ_TIMEOUT,
+        ),
+    ) as res:
+        res.raise_for_status()
+        return await res.json()
+
+
+async def analyze_text_async(
+    prompt: str, schema, model: str = TOGETHER_TEXT_MODEL, validate=None
+) -> str:
+    """Async variant of analyze_text that doesn't block the event loop."""
+    messages = _text_messages(prompt)
+    json_schema = schema.model_json_schema()
+    cache_key = make_cache_key(model, messages, json_schema)
+    cached = await asyncio.to_thread(_cache_lookup, cache_key)
+    if cached is not None:
+        return cached
+
+    async def fetch():
+        # Calls with the same model and schema have comparable latency
+        extract = await limiters["together"].call_hedged_async(
+            (model, schema.__name__),
+            timed_async("together", model, _chat_completion_async),
             {
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": prompt},
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": image_url,
-                        },
-                    },
-                ],
+                "messages": messages,
+                "model": model,
+                "response_format": {"type": "json_object", "schema": json_schema},
             },
-        ],
-        model=model,
-        # response_format={"type": "json_object", "schema": schema.model_json_schema()},
+        )
+        _record_usage(model, extract)
+        output = json.loads(extract["choices"][0]["message"]["content"])
+        if _cacheable(output, schema, validate):
+            await asyncio.to_thread(_cache_store, cache_key, output)
+        return output
+
+    return await llm_flight.do(cache_key, fetch)
+
+
+async def analyze_text_image_async(
+    prompt: str,
+    image_url: str,
+    schema,
+    model: str = TOGETHER_VISION_MODEL,
+) -> str:
+    """Async variant of analyze_text_image that doesn't block the event loop."""
+    messages = _text_image_messages(prompt, image_url)
+    cache_key = make_cache_key(model, messages, schema.model_json_schema())
+    cached = await asyncio.to_thread(_cache_lookup, cache_key)
+    if cached is not None:
+        return cached
+
+    async def fetch():
+        # Calls with the same model and schema have comparable latency
+        extract = await limiters["together"].call_hedged_async(
+            (model, schema.__name__),
+            timed_async("together", model, _chat_completion_async),
+            {"messages": messages, "model": model},
+        )
+        _record_usage(model, extract)
+        output = extract["choices"][0]["message"]["content"]
+        if _cacheable(output, schema):
+            await asyncio.to_thread(_cache_store, cache_key, output)
+        return output
+
+    return await llm_flight.do(cache_key, fetch)
+
+
+def _token_logprobs(logprobs) -> list:
+    """(token, logprob) pairs from the logprobs of a completion choice (SDK object or JSON)."""
+    if not logprobs:
+        return []
+    if isinstance(logprobs, dict):
+        tokens, values = logprobs.get("tokens"), logprobs.get("token_logprobs")
+    else:
+        tokens = getattr(logprobs, "tokens", None)
+        values = getattr(logprobs, "token_logprobs", None)
+    return [
+        [token, value]
+        for token, value in zip(tokens or [], values or [])
+        if value is not None
+    ]
+
+
+def analyze_text_scored(
+    prompt: str, schema, model: str, validate=None
+) -> tuple:
+    """
+    analyze_text that also returns the token log probabilities of the answer.
+
+    Returns:
+        tuple: (parsed JSON output, list of [token, logprob] pairs)
+    """
+    messages = _text_messages(prompt)
+    json_schema = schema.model_json_schema()
+    cache_key = make_cache_key(
+        model, messages, {"schema": json_schema, "logprobs": True}
+    )
+    cached = _cache_lookup(cache_key)
+    if cached is not None:
+        return cached["output"], cached["token_logprobs"]
+
+    def fetch():
+        extract = limiters["together"].call(
+            timed("together", model, together.chat.completions.create),
+            messages=messages,
+            model=model,
+            response_format={"type": "json_object", "schema": json_schema},
+            logprobs=1,
+        )
+        _record_usage(model, extract)
+        choice = extract.choices[0]
+        scored = {
+            "output": json.loads(choice.message.content),
+            "token_logprobs": _token_logprobs(choice.logprobs),
+        }
+        if _cacheable(scored["output"], schema, validate):
+            _cache_store(cache_key, scored)
+        return scored
+
+    scored = llm_flight.call(cache_key, fetch)
+    return scored["output"], scored["token_logprobs"]
+
+
+async def analyze_text_scored_async(
+    prompt: str, schema, model: str, validate=None
+) -> tuple:
+    """Async variant of analyze_text_scored."""
+    messages = _text_messages(prompt)
+    json_schema = schema.model_json_schema()
+    cache_key = make_cache_key(
+        model, messages, {"schema": json_schema, "logprobs": True}
     )
-    # print(extract)
-    output = extract.choices[0].message.content
+    cached = await asyncio.to_thread(_cache_lookup, cache_key)
+    if cached is not None:
+        return cached["output"], cached["token_logprobs"]
+
+    async def fetch():
+        # Calls with the same model and schema have comparable latency
+        extract = await limiters["together"].call_hedged_async(
+            (model, schema.__name__),
+            timed_async("together", model, _chat_completion_async),
+            {
+                "messages": messages,
+                "model": model,
+                "response_format": {"type": "json_object", "schema": json_schema},
+                "logprobs": 1,
+            },
+        )
+        _record_usage(model, extract)
+        choice = extract["choices"][0]
+        scored = {
+            "output": json.loads(choice["message"]["content"]),
+            "token_logprobs": _token_logprobs(choice.get("logprobs")),
+        }
+        if _cacheable(scored["output"], schema, validate):
+            await asyncio.to_thread(_cache_store, cache_key, scored)
+        return scored
+
+    scored = await llm_flight.do(cache_key, fetch)
+    return scored["output"], scored["token_logprobs"]
+
+
+_cascade_stats = {}
+_cascade_stats_lock = threading.Lock()
+
+
+def _record_tier(model: str, decided: int = 0, escalated: int = 0):
+    with _cascade_stats_lock:
+        stats = _cascade_stats.setdefault(model, {"decided": 0, "escalated": 0})
+        stats["decided"] += decided
+        stats["escalated"] += escalated
+
+
+def cascade_stats() -> list:
+    """Per-tier counts of answers decided vs. escalated, in cascade order."""
+    tiers = []
+    with _cascade_stats_lock:
+        for model in MODEL_CASCADE:
+            stats = dict(_cascade_stats.get(model, {"decided": 0, "escalated": 0}))
+            total = stats["decided"] + stats["escalated"]
+            stats["hit_rate"] = round(stats["decided"] / total, 3) if total else None
+            tiers.append({"model": model, **stats})
+    return tiers
+
+
+def _cascade_tiers() -> list:
+    return MODEL_CASCADE if MODEL_CASCADE_ENABLED else MODEL_CASCADE[-1:]
+
+
+def verdict_confidences(token_logprobs: list) -> list:
+    """Probability of every 'yes'/'no' token of an answer, in order."""
+    return [
+        math.exp(logprob)
+        for token, logprob in token_logprobs
+        if token.strip().strip('"').lower() in ("yes", "no")
+    ]
+
+
+def _relevance_confidence(output: dict, token_logprobs: list) -> float:
+    confidences = verdict_confidences(token_logprobs)
+    if output.get("is_relevant") not in ("yes", "no") or not confidences:
+        return 0.0
+    return confidences[0]
+
+
+def _keyword_confidence(output: dict, token_logprobs: list) -> float:
+    # The least certain token of the answer bounds the confidence in the keyword
+    if not output.get("keyword") or not token_logprobs:
+        return 0.0
+    return math.exp(min(logprob for _, logprob in token_logprobs))
+
+
+def analyze_text_cascade(
+    prompt: str, schema, confidence_fn, min_confidence: float
+) -> dict:
+    """
+    Answers a prompt with the cheapest model of MODEL_CASCADE that is confident.
+
+    Every tier but the last is called with logprobs and its answer is accepted when
+    confidence_fn(output, token_logprobs) reaches min_confidence; otherwise (or on
+    error) the prompt escalates to the next tier. The last tier always decides.
+    """
+    tiers = _cascade_tiers()
+    for model in tiers[:-1]:
+        try:
+            output, token_logprobs = analyze_text_scored(prompt, schema, model)
+            confident = confidence_fn(output, token_logprobs) >= min_confidence
+        except Exception as e:
+            print(f"Cascade tier {model} failed, escalating: {e}")
+            confident = False
+        _record_tier(model, decided=int(confident), escalated=int(not confident))
+        if confident:
+            return output
+
+    output = analyze_text(prompt, schema, model=tiers[-1])
+    _record_tier(tiers[-1], decided=1)
     return output
 
 
-def idea_from_ad_text_using_together(text: str, product_name: str) -> str:
-    prompt = f"""Analyze the reference advertisement text: {text}
+async def analyze_text_cascade_async(
+    prompt: str, schema, confidence_fn, min_confidence: float
+) -> dict:
+    """Async variant of analyze_text_cascade."""
+    tiers = _cascade_tiers()
+    for model in tiers[:-1]:
+        try:
+            output, token_logprobs = await analyze_text_scored_async(
+                prompt, schema, model
+            )
+            confident = confidence_fn(output, token_logprobs) >= min_confidence
+        except Exception as e:
+            print(f"Cascade tier {model} failed, escalating: {e}")
+            confident = False
+        _record_tier(model, decided=int(confident), escalated=int(not confident))
+        if confident:
+            return output
+
+    output = await analyze_text_async(prompt, schema, model=tiers[-1])
+    _record_tier(tiers[-1], decided=1)
+    return output
+
+
+def _idea_from_ad_text_prompt(text: str, product_name: str) -> str:
+    return f"""Analyze the reference advertisement text: {text}
     For {product_name}, extract the advertising pattern used focusing on:
     - Text structure and tone
     - Announcement style
@@ -99,37 +558,19 @@ def idea_from_ad_text_using_together(text: str, product_name: str) -> str:
     - Key messaging elements
     Generate a template-style idea that explains how to adapt this text pattern while maintaining the same impact."""
 
-    result = analyze_text(prompt, AdvertisementIdea)
-    return result
-
 
-def idea_from_ad_image_using_together(image_url: str, product_name: str) -> str:
-    prompt = f"""For {product_name}, analyze this reference advertisement image focusing on:
+def _idea_from_ad_image_prompt(product_name: str) -> str:
+    return f"""For {product_name}, analyze this reference advertisement image focusing on:
     - Overall visual composition
     - Product positioning
     - Image-to-text ratio and layout
     - Visual style and elements
     Generate a template-style idea that explains how to adapt this visual pattern while maintaining the same impact. limit this under 500 characters."""
 
-    result = analyze_text_image(prompt, image_url, AdvertisementIdea)
-    return result
 
-
-def generate_text_for_marketing_post(
+def _marketing_post_prompt(
     idea: str, company_name: str, product_name: str, user_input: str = ""
 ) -> str:
-    """
-    Generate a marketing post based on the idea, company details and optional user input.
-
-    Args:
-        idea (str): The core idea/concept for the marketing post
-        company_name (str): Name of the company
-        product_name (str): Name of the product
-        user_input (str): Optional additional requirements or preferences for the post
-
-    Returns:
-        str: Generated marketing post content
-    """
     # Build the prompt incorporating all inputs
     prompt = f"""Generate a compelling marketing post for {product_name} by {company_name}.
 
@@ -145,19 +586,15 @@ Guidelines:
     if user_input:
         prompt += f"\n\nAdditional Requirements:\n{user_input}"
 
-    result = analyze_text(prompt, AdvertisementText)
-    return result["advertisement_text"]
+    return prompt
 
 
-def analyze_product_name(product_name: str, company_name: str) -> str:
-    """Generates a search keyword based on product name analysis."""
-    prompt = f"Generate a short keyword phrase that represents the product: {product_name}. Company name, any adjective or any superlative should not be present in keyword, remove company name {company_name}"
-    result = analyze_text(prompt, AnalysisResult)
-    return result["keyword"]
+def _product_name_prompt(product_name: str, company_name: str) -> str:
+    return f"Generate a short keyword phrase that represents the product: {product_name}. Company name, any adjective or any superlative should not be present in keyword, remove company name {company_name}"
 
 
-def validate_with_together_ai(ad_text, query):
-    prompt = f""" Analyze if the following Meta ad text is related to the keyword: {query}
+def _relevance_prompt(ad_text: str, query: str) -> str:
+    return f""" Analyze if the following Meta ad text is related to the keyword: {query}
 
     Ad Text:
     {ad_text}
@@ -173,8 +610,361 @@ def validate_with_together_ai(ad_text, query):
 
     Response: """
 
-    response = analyze_text(prompt, RelevanceResponse)
 
-    # Here, replace with actual Together AI API call logic
-    # For demonstration, let's assume it returns True if ad_text contains the query term.
+def _batch_relevance_prompt(ad_texts: list, query: str) -> str:
+    ads_block = "\n\n".join(
+        f"Ad {number}:\n{ad_text}" for number, ad_text in enumerate(ad_texts, start=1)
+    )
+    return f""" Analyze if each of the following Meta ad texts is related to the keyword: {query}
+
+    {ads_block}
+
+    Guidelines for analysis:
+    1. Check if the text directly mentions the keyword or its close variations
+    2. Look for semantic relationships between the text content and the keyword
+    3. Consider the context and intended audience of the ad
+    4. Analyze if the ad's message or product/service is related to the keyword theme
+
+    Based on the above analysis, determine for every ad if the text is relevant to the keyword.
+    Return one result per ad with its ad_number and 'yes' or 'no'.
+
+    Response: """
+
+
+def chunk_ads_by_token_budget(
+    ad_texts: list,
+    token_budget: int = RELEVANCE_BATCH_TOKEN_BUDGET,
+    max_ads: int = RELEVANCE_BATCH_MAX_ADS,
+) -> list:
+    """
+    Splits ad texts into batches that fit a prompt token budget.
+
+    Returns:
+        list: Lists of indexes into ad_texts, in order. An ad larger than the budget
+        gets a batch of its own.
+    """
+    chunks, current, current_tokens = [], [], 0
+    for index, ad_text in enumerate(ad_texts):
+        tokens = estimate_tokens(ad_text)
+        if current and (
+            current_tokens + tokens > token_budget or len(current) >= max_ads
+        ):
+            chunks.append(current)
+            current, current_tokens = [], 0
+        current.append(index)
+        current_tokens += tokens
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _parse_batch_relevance(response: dict, ad_count: int) -> list:
+    """Validates a batch response, raising ValueError unless every ad got exactly one verdict."""
+    try:
+        parsed = BatchRelevanceResponse.model_validate(response)
+    except ValidationError as e:
+        raise ValueError(f"Invalid batch relevance response: {e}") from e
+
+    verdicts = {item.ad_number: item.is_relevant for item in parsed.results}
+    if sorted(verdicts) != list(range(1, ad_count + 1)):
+        raise ValueError(
+            f"Batch relevance response covers ads {sorted(verdicts)}, expected 1..{ad_count}"
+        )
+    return [verdicts[number] for number in range(1, ad_count + 1)]
+
+
+def _batch_confidences(output: dict, token_logprobs: list, ad_count: int) -> list:
+    """Confidence per ad (1-based ad_number order) of a validated batch answer."""
+    confidences = verdict_confidences(token_logprobs)
+    results = output["results"]
+    if len(confidences) != len(results):
+        return [0.0] * ad_count
+    by_ad = {item["ad_number"]: c for item, c in zip(results, confidences)}
+    return [by_ad[number] for number in range(1, ad_count + 1)]
+
+
+def _classify_chunk_cascade(chunk_texts: list, query: str, tiers: list) -> list:
+    """
+    Batch relevance verdicts for one chunk through the model cascade.
+
+    Ads the current tier is not confident about are re-classified, as a smaller
+    batch, by the next tier. Raises ValueError if the last tier's answer is invalid.
+    """
+    prompt = _batch_relevance_prompt(chunk_texts, query)
+
+    def covers_chunk(output):
+        # Answers missing or repeating an ad must not be cached either
+        return _parse_batch_relevance(output, len(chunk_texts))
+
+    if len(tiers) == 1:
+        response = analyze_text(
+            prompt, BatchRelevanceResponse, model=tiers[0], validate=covers_chunk
+        )
+        verdicts = _parse_batch_relevance(response, len(chunk_texts))
+        _record_tier(tiers[0], decided=len(chunk_texts))
+        return verdicts
+
+    try:
+        output, token_logprobs = analyze_text_scored(
+            prompt, BatchRelevanceResponse, tiers[0], validate=covers_chunk
+        )
+        verdicts = _parse_batch_relevance(output, len(chunk_texts))
+        confidences = _batch_confidences(output, token_logprobs, len(chunk_texts))
+    except Exception as e:
+        print(f"Cascade tier {tiers[0]} failed, escalating: {e}")
+        verdicts, confidences = [None] * len(chunk_texts), [0.0] * len(chunk_texts)
+
+    uncertain = [
+        index
+        for index, confidence in enumerate(confidences)
+        if confidence < RELEVANCE_CASCADE_CONFIDENCE
+    ]
+    _record_tier(
+        tiers[0], decided=len(chunk_texts) - len(uncertain), escalated=len(uncertain)
+    )
+    if uncertain:
+        escalated = _classify_chunk_cascade(
+            [chunk_texts[index] for index in uncertain], query, tiers[1:]
+        )
+        for index, verdict in zip(uncertain, escalated):
+            verdicts[index] = verdict
+    return verdicts
+
+
+async def _classify_chunk_cascade_async(
+    chunk_texts: list, query: str, tiers: list
+) -> list:
+    """Async variant of _classify_chunk_cascade."""
+    prompt = _batch_relevance_prompt(chunk_texts, query)
+
+    def covers_chunk(output):
+        # Answers missing or repeating an ad must not be cached either
+        return _parse_batch_relevance(output, len(chunk_texts))
+
+    if len(tiers) == 1:
+        response = await analyze_text_async(
+            prompt, BatchRelevanceResponse, model=tiers[0], validate=covers_chunk
+        )
+        verdicts = _parse_batch_relevance(response, len(chunk_texts))
+        _record_tier(tiers[0], decided=len(chunk_texts))
+        return verdicts
+
+    try:
+        output, token_logprobs = await analyze_text_scored_async(
+            prompt, BatchRelevanceResponse, tiers[0], validate=covers_chunk
+        )
+        verdicts = _parse_batch_relevance(output, len(chunk_texts))
+        confidences = _batch_confidences(output, token_logprobs, len(chunk_texts))
+    except Exception as e:
+        print(f"Cascade tier {tiers[0]} failed, escalating: {e}")
+        verdicts, confidences = [None] * len(chunk_texts), [0.0] * len(chunk_texts)
+
+    uncertain = [
+        index
+        for index, confidence in enumerate(confidences)
+        if confidence < RELEVANCE_CASCADE_CONFIDENCE
+    ]
+    _record_tier(
+        tiers[0], decided=len(chunk_texts) - len(uncertain), escalated=len(uncertain)
+    )
+    if uncertain:
+        escalated = await _classify_chunk_cascade_async(
+            [chunk_texts[index] for index in uncertain], query, tiers[1:]
+        )
+        for index, verdict in zip(uncertain, escalated):
+            verdicts[index] = verdict
+    return verdicts
+
+
+@traced()
+def idea_from_ad_text_using_together(text: str, product_name: str) -> str:
+    text = prepare_ad_copy(text, TOGETHER_TEXT_MODEL)
+    prompt = _idea_from_ad_text_prompt(text, product_name)
+    result = analyze_text(prompt, AdvertisementIdea)
+    return result
+
+
+@traced()
+def idea_from_ad_image_using_together(image_url: str, product_name: str) -> str:
+    image_url = thumbnail_data_url(image_url)
+    prompt = _idea_from_ad_image_prompt(product_name)
+    result = analyze_text_image(prompt, image_url, AdvertisementIdea)
+    return result
+
+
+@traced()
+def generate_text_for_marketing_post(
+    idea: str, company_name: str, product_name: str, user_input: str = ""
+) -> str:
+    """
+    Generate a marketing post based on the idea, company details and optional user input.
+
+    Args:
+        idea (str): The core idea/concept for the marketing post
+        company_name (str): Name of the company
+        product_name (str): Name of the product
+        user_input (str): Optional additional requirements or preferences for the post
+
+    Returns:
+        str: Generated marketing post content
+    """
+    prompt = _marketing_post_prompt(idea, company_name, product_name, user_input)
+    result = analyze_text(prompt, AdvertisementText)
+    return result["advertisement_text"]
+
+
+@traced()
+def analyze_product_name(product_name: str, company_name: str) -> str:
+    """Generates a search keyword based on product name analysis."""
+    prompt = _product_name_prompt(product_name, company_name)
+    result = analyze_text_cascade(
+        prompt, AnalysisResult, _keyword_confidence, KEYWORD_CASCADE_CONFIDENCE
+    )
+    return result["keyword"]
+
+
+@traced()
+def validate_with_together_ai(ad_text, query):
+    prompt = _relevance_prompt(prepare_ad_copy(ad_text, TOGETHER_TEXT_MODEL), query)
+    response = analyze_text_cascade(
+        prompt, RelevanceResponse, _relevance_confidence, RELEVANCE_CASCADE_CONFIDENCE
+    )
+    return response["is_relevant"]
+
+
+@traced()
+def validate_batch_with_together_ai(ad_texts: list, query: str) -> list:
+    """
+    Classifies many ad texts against a keyword with one call per token-budget chunk.
+
+    Ad texts are preprocessed (see ad_text.prepare_ad_copy) before chunking and
+    every chunk goes through the model cascade. Falls back to per-ad calls for a
+    chunk whose response fails validation.
+
+    Returns:
+        list: 'yes' or 'no' per ad text, in input order
+    """
+    ad_texts = [prepare_ad_copy(ad_text, TOGETHER_TEXT_MODEL) for ad_text in ad_texts]
+    verdicts = [None] * len(ad_texts)
+    for chunk in chunk_ads_by_token_budget(ad_texts):
+        chunk_texts = [ad_texts[index] for index in chunk]
+        try:
+            chunk_verdicts = _classify_chunk_cascade(
+                chunk_texts, query, _cascade_tiers()
+            )
+        except (ValueError, TypeError) as e:
+            print(f"Batch relevance check failed, falling back to per-ad calls: {e}")
+            chunk_verdicts = [
+                analyze_text(
+                    _relevance_prompt(ad_text, query),
+                    RelevanceResponse,
+                    model=MODEL_CASCADE[-1],
+                )["is_relevant"]
+                for ad_text in chunk_texts
+            ]
+        for index, verdict in zip(chunk, chunk_verdicts):
+            verdicts[index] = verdict
+    return verdicts
+
+
+@traced()
+async def idea_from_ad_text_using_together_async(text: str, product_name: str) -> str:
+    text = prepare_ad_copy(text, TOGETHER_TEXT_MODEL)
+    prompt = _idea_from_ad_text_prompt(text, product_name)
+    result = await analyze_text_async(prompt, AdvertisementIdea)
+    return result
+
+
+@traced()
+async def idea_from_ad_image_using_together_async(
+    image_url: str, product_name: str
+) -> str:
+    image_url = await thumbnail_data_url_async(image_url)
+    return await idea_from_ad_thumbnail_using_together_async(image_url, product_name)
+
+
+@traced()
+async def idea_from_ad_thumbnail_using_together_async(
+    image_url: str, product_name: str
+) -> str:
+    """
+    idea_from_ad_image_using_together_async for an image the caller already ran
+    through thumbnail_data_url_async (or whose download failed): sent as given.
+    """
+    prompt = _idea_from_ad_image_prompt(product_name)
+    result = await analyze_text_image_async(prompt, image_url, AdvertisementIdea)
+    return result
+
+
+@traced()
+async def generate_text_for_marketing_post_async(
+    idea: str, company_name: str, product_name: str, user_input: str = ""
+) -> str:
+    """Async variant of generate_text_for_marketing_post."""
+    prompt = _marketing_post_prompt(idea, company_name, product_name, user_input)
+    result = await analyze_text_async(prompt, AdvertisementText)
+    return result["advertisement_text"]
+
+
+@traced()
+async def analyze_product_name_async(product_name: str, company_name: str) -> str:
+    """Async variant of analyze_product_name."""
+    prompt = _product_name_prompt(product_name, company_name)
+    result = await analyze_text_cascade_async(
+        prompt, AnalysisResult, _keyword_confidence, KEYWORD_CASCADE_CONFIDENCE
+    )
+    return result["keyword"]
+
+
+@traced()
+async def validate_with_together_ai_async(ad_text, query):
+    prompt = _relevance_prompt(prepare_ad_copy(ad_text, TOGETHER_TEXT_MODEL), query)
+    response = await analyze_text_cascade_async(
+        prompt, RelevanceResponse, _relevance_confidence, RELEVANCE_CASCADE_CONFIDENCE
+    )
     return response["is_relevant"]
+
+
+@traced()
+async def validate_batch_with_together_ai_async(
+    ad_texts: list, query: str, prepared: bool = False
+) -> list:
+    """
+    Async variant of validate_batch_with_together_ai; chunks are classified concurrently.
+
+    Pass prepared=True when ad_texts already went through prepare_ad_copy, e.g.
+    because the caller chunked them itself.
+    """
+
+    async def classify_chunk(chunk_texts: list) -> list:
+        try:
+            return await _classify_chunk_cascade_async(
+                chunk_texts, query, _cascade_tiers()
+            )
+        except (ValueError, TypeError) as e:
+            print(f"Batch relevance check failed, falling back to per-ad calls: {e}")
+            responses = await asyncio.gather(
+                *(
+                    analyze_text_async(
+                        _relevance_prompt(ad_text, query),
+                        RelevanceResponse,
+                        model=MODEL_CASCADE[-1],
+                    )
+                    for ad_text in chunk_texts
+                )
+            )
+            return [response["is_relevant"] for response in responses]
+
+    if not prepared:
+        ad_texts = [
+            prepare_ad_copy(ad_text, TOGETHER_TEXT_MODEL) for ad_text in ad_texts
+        ]
+    chunks = chunk_ads_by_token_budget(ad_texts)
+    chunk_verdicts = await asyncio.gather(
+        *(classify_chunk([ad_texts[index] for index in chunk]) for chunk in chunks)
+    )
+    verdicts = [None] * len(ad_texts)
+    for chunk, chunk_verdict in zip(chunks, chunk_verdicts):
+        for index, verdict in zip(chunk, chunk_verdict):
+            verdicts[index] = verdict
+    return verdicts
@@ -0,0 +1,220 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import threading
+import functools
+import contextvars
+from contextlib import contextmanager
+from dotenv import load_dotenv
+load_dotenv(override=True)
+
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "false").lower() == "true"
+# "jsonl": one span per line; "chrome": trace events for chrome://tracing / Perfetto
+TRACE_FORMAT = os.getenv("TRACE_FORMAT", "jsonl").lower()
+TRACE_FILE = os.getenv(
+    "TRACE_FILE", ".cache/traces.json" if TRACE_FORMAT == "chrome" else ".cache/traces.jsonl"
+)
+
+# Span of the code currently running. Async tasks and asyncio.to_thread copy the
+# context they are started from, so their spans become children automatically;
+# plain threads need in_current_context.
+_current_span = contextvars.ContextVar("current_span", default=None)
+_write_lock = threading.Lock()
+_trace_file = None
+
+
+class Span:
+    """One timed operation of a trace, written to TRACE_FILE when it ends."""
+
+    def __init__(self, name: str, parent: "Span | None" = None, **attributes):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex[:16]
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = attributes
+        self.error = None
+        self.start = time.time()
+        self._started = time.perf_counter()
+        self._lane = _lane()
+        self._ended = False
+
+    def set(self, **attributes):
+        """Adds attributes, e.g. counts only known once the operation ran."""
+        self.attributes.update(attributes)
+
+    def end(self, error: BaseException | None = None):
+        if self._ended:
+            return
+        self._ended = True
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        _export(self, time.perf_counter() - self._started)
+
+
+def _lane() -> int:
+    """Timeline row of a span: the asyncio task running it, else its thread."""
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    return id(task) if task is not None else threading.get_ident()
+
+
+def _open_trace_file():
+    global _trace_file
+    if _trace_file is None:
+        directory = os.path.dirname(TRACE_FILE)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        _trace_file = open(TRACE_FILE, "a", encoding="utf-8")
+        if TRACE_FORMAT == "chrome" and _trace_file.tell() == 0:
+            # The trace viewers accept an array without its closing bracket
+            _trace_file.write("[\n")
+    return _trace_file
+
+
+def _chrome_events(span: Span, duration: float) -> list:
+    # One "process" per trace, so each request gets its own group in the viewer
+    pid = int(span.trace_id[:8], 16)
+    events = [
+        {
+            "name": span.name,
+            "cat": span.name.split(" ")[0],
+            "ph": "X",
+            "ts": round(span.start * 1e6),
+            "dur": round(duration * 1e6),
+            "pid": pid,
+            "tid": span._lane,
+            "args": {
+                "trace_id": span.trace_id,
+                "span_id": span.span_id,
+                "parent_id": span.parent_id,
+                "error": span.error,
+                **span.attributes,
+            },
+        }
+    ]
+    if span.parent_id is None:
+        events.append(
+            {
+                "name": "process_name",
+                "ph": "M",
+                "pid": pid,
+                "args": {"name": f"{span.name} ({span.trace_id})"},
+            }
+        )
+    return events
+
+
+def _export(span: Span, duration: float):
+    if TRACE_FORMAT == "chrome":
+        lines = [
+            json.dumps(event, default=str, ensure_ascii=False) + ","
+            for event in _chrome_events(span, duration)
+        ]
+    else:
+        record = {
+            "trace_id": span.trace_id,
+            "span_id": span.span_id,
+            "parent_id": span.parent_id,
+            "name": span.name,
+            "start": span.start,
+            "duration_ms": round(duration * 1000, 3),
+            "lane": span._lane,
+            "error": span.error,
+            "attributes": span.attributes,
+        }
+        lines = [json.dumps(record, default=str, ensure_ascii=False)]
+    try:
+        with _write_lock:
+            trace_file = _open_trace_file()
+            trace_file.write("\n".join(lines) + "\n")
+            trace_file.flush()
+    except OSError as e:
+        print(f"Writing span {span.name} to {TRACE_FILE} failed: {e}")
+
+
+def start_span(name: str, **attributes) -> tuple:
+    """
+    Starts a span and makes it the current span, for spans that can't be a `with` block.
+
+    Returns:
+        tuple: (span, token); pass the token to end_span_scope in the same context,
+            then call span.end() when the operation finishes. (None, None) when
+            tracing is off.
+    """
+    if not TRACING_ENABLED:
+        return None, None
+    span = Span(name, _current_span.get(), **attributes)
+    return span, _current_span.set(span)
+
+
+def end_span_scope(token):
+    """Restores the span that was current before start_span."""
+    if token is not None:
+        _current_span.reset(token)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Traces the enclosed block as a child of the current span.
+
+    Yields the Span (None when tracing is off). Do not `yield` from a generator
+    inside the block: the span would leak into the consumer.
+    """
+    current, token = start_span(name, **attributes)
+    if current is None:
+        yield None
+        return
+    try:
+        yield current
+    except BaseException as e:
+        current.end(e)
+        raise
+    finally:
+        end_span_scope(token)
+        current.end()
+
+
+def traced(name: str | None = None):
+    """Decorator tracing every call of a sync or async function as one span."""
+
+    def decorate(fn):
+        span_name = name or fn.__name__
+        if asyncio.iscoroutinefunction(fn):
+
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name):
+                    return await fn(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+def in_current_context(fn):
+    """Binds fn to the current span, for functions handed to a thread pool."""
+    context = contextvars.copy_context()
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        # A context can only be entered by one thread at a time
+        return context.copy().run(fn, *args, **kwargs)
+
+    return wrapper
+
+
+def current_trace_id() -> str | None:
+    current = _current_span.get()
+    return current.trace_id if current else None